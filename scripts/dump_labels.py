@@ -1,41 +1,48 @@
 import sys
+import zipfile
 from pathlib import Path
-from docx import Document
+from docx.oxml.parser import element_class_lookup
+from lxml import etree
 
+from wordreportcheck.parsers.docx_parser import _row_grid_tcs, _tc_text
+from wordreportcheck.parsers.docx_writer import find_value_cell
 
-def find_value_cell(row, label: str):
-    cells = list(row.cells)
-    for idx, cell in enumerate(cells):
-        if label in (cell.text or ""):
-            if len(cells) >= 2:
-                if idx + 1 < len(cells):
-                    return idx + 1
-                else:
-                    return 0
-            else:
-                return 0
-    return None
+
+def load_document_xml(doc_path: Path):
+    """直接读取 docx 中的 word/document.xml 并解析为 lxml 元素树，不打开整个文档包。
+    从 zip 条目流式解析，不先把整段 XML 读入内存；使用 python-docx 的元素类，
+    表格、行、单元格可直接按 python-docx 的规则读取（合并单元格、段落文本等）。
+    """
+    parser = etree.XMLParser(huge_tree=True, collect_ids=False, remove_blank_text=True, resolve_entities=False)
+    parser.set_element_class_lookup(element_class_lookup)
+    with zipfile.ZipFile(str(doc_path)) as zf, zf.open("word/document.xml") as f:
+        return etree.parse(f, parser=parser).getroot()
 
 
 def main(doc_path: str):
     p = Path(doc_path)
-    doc = Document(str(p))
-    for t_i, table in enumerate(doc.tables):
-        for r_i, row in enumerate(table.rows):
-            texts = [c.text for c in row.cells]
+    root = load_document_xml(p)
+    # 与 doc.tables / row.cells 一致：仅遍历正文顶层表格，每个网格列对应一个单元格（合并单元格按跨列重复）；
+    # 单元格文本只取直接子段落（含制表符与换行），不含嵌套表格
+    for t_i, tbl in enumerate(root.body.tbl_lst):
+        for r_i, tr in enumerate(tbl.tr_lst):
+            texts = [_tc_text(tc) for tc in _row_grid_tcs(tr)]
             joined = " | ".join(texts)
-            if ("成绩" in joined) or ("日期" in joined):
-                vi_grade = find_value_cell(row, "成绩")
-                vi_date = find_value_cell(row, "日期")
+            # 每个标签只在整行文本上判断一次，缺失的标签不再逐单元格查找
+            has_grade = "成绩" in joined
+            has_date = "日期" in joined
+            if has_grade or has_date:
+                vi_grade = find_value_cell(texts, "成绩") if has_grade else None
+                vi_date = find_value_cell(texts, "日期") if has_date else None
                 print(f"[table {t_i} row {r_i}] {joined}")
                 if vi_grade is not None:
-                    print(f"  成绩值单元格 -> '{row.cells[vi_grade].text}'")
+                    print(f"  成绩值单元格 -> '{texts[vi_grade]}'")
                 if vi_date is not None:
-                    print(f"  日期值单元格 -> '{row.cells[vi_date].text}'")
+                    print(f"  日期值单元格 -> '{texts[vi_date]}'")
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: python scripts/dump_labels.py <docx>")
         sys.exit(2)
-    main(sys.argv[1])
\ No newline at end of file
+    main(sys.argv[1])
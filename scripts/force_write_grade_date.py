@@ -1,51 +1,96 @@
 from pathlib import Path
 from datetime import datetime
 from docx import Document
+from docx.table import _Cell
+from lxml import etree
 import argparse
+import os
+import shutil
+import tempfile
 
+from wordreportcheck.parsers.docx_parser import _row_grid_tcs, _tc_text
+from wordreportcheck.parsers.docx_writer import find_value_cell, save_document_part as _save_document_part
+
+
+NS = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main"}
+# 模块加载时编译一次，批量处理多个文档时复用
+XP_T = etree.XPath(".//w:t", namespaces=NS)
+
+
+def _set_cell_text_fast(tc, value: str) -> None:
+    """单元格恰有一个文本节点时原地替换其文本（保留原有格式），否则回退到 cell.text 赋值。"""
+    ts = XP_T(tc)
+    if len(ts) == 1:
+        ts[0].text = value
+    else:
+        _Cell(tc, None).text = value
 
-def find_value_cell(row, label: str):
-    cells = list(row.cells)
-    for idx, cell in enumerate(cells):
-        if label in (cell.text or ""):
-            if len(cells) >= 2:
-                if idx + 1 < len(cells):
-                    return idx + 1
-                else:
-                    return 0
-            else:
-                return 0
-    return None
 
+def save_document_part(doc, doc_path: Path) -> None:
+    """仅重写主文档部件（word/document.xml），其余部件按原样流式拷贝（docx_writer.save_document_part）。
+    先写入同目录下唯一命名的临时文件，再原子替换原文件；失败时删除临时文件。
+    """
+    fd, tmp_name = tempfile.mkstemp(prefix=doc_path.name + ".", suffix=".tmp", dir=str(doc_path.parent))
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        _save_document_part(doc, doc_path, tmp_path)
+        shutil.copymode(str(doc_path), str(tmp_path))
+        os.replace(str(tmp_path), str(doc_path))
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
-def write(doc_path: Path, grade: str, date_str: str):
-    doc = Document(str(doc_path))
+
+def write(doc_path: Path, grade: str, date_str: str, doc=None) -> bool:
+    """写入成绩与日期，返回是否修改了文档。
+    传入已打开的 doc 时只修改不保存，由调用方在批量修改后统一保存（save_document_part 或 doc.save）。
+    """
+    owns_doc = doc is None
+    if owns_doc:
+        doc = Document(str(doc_path))
     wrote = False
-    for table in doc.tables:
-        # 写入成绩：按标签“成绩”匹配并写入其相邻单元格
-        for row in table.rows:
-            vi_g = find_value_cell(row, "成绩")
-            if vi_g is not None:
-                row.cells[vi_g].text = grade
-                wrote = True
-
-        # 写入日期：仅写入该表格的最后一行
-        if len(table.rows) > 0:
-            last_row = table.rows[-1]
-            vi_d = find_value_cell(last_row, "日期")
-            if vi_d is not None:
-                last_row.cells[vi_d].text = date_str
-                wrote = True
-            else:
-                # 回退：若最后一行没有“日期”标签，则写入第二个单元格（若存在），否则写入第一个单元格
-                cells = list(last_row.cells)
-                if len(cells) >= 2:
-                    cells[1].text = date_str
-                elif len(cells) >= 1:
-                    cells[0].text = date_str
-                wrote = True
-    if wrote:
-        doc.save(str(doc_path))
+    # 直接遍历正文顶层 <w:tbl>/<w:tr>/<w:tc>，不再为每个表格、行、单元格构造 python-docx 包装对象。
+    # 与 row.cells 一致，每个网格列对应一个 <w:tc>（合并单元格按跨列重复，纵向合并取起始单元格）
+    for tbl in doc.element.body.tbl_lst:
+        rows = [_row_grid_tcs(tr) for tr in tbl.tr_lst]
+        if not rows:
+            continue
+        # 预扫描：整表文本不含“成绩”时跳过逐行查找，只处理最后一行的日期。
+        # 按文本节点拼接判断而非序列化 XML，避免标签被拆到多个 run 时漏判
+        has_grade = "成绩" in "".join(tbl.itertext())
+        last_idx = len(rows) - 1
+        # 单次遍历：每行文本只提取一次，最后一行的文本同时用于成绩与日期查找
+        for r_i, cells in enumerate(rows):
+            if not has_grade and r_i != last_idx:
+                continue
+            texts = [_tc_text(tc) for tc in cells]
+
+            # 写入成绩：按标签“成绩”匹配并写入其相邻单元格
+            if has_grade:
+                vi_g = find_value_cell(texts, "成绩")
+                if vi_g is not None:
+                    target = cells[vi_g]
+                    _set_cell_text_fast(target, grade)
+                    # 同一 <w:tc> 可能占据多个网格列，这些列的文本一并更新
+                    texts = [grade if tc is target else t for tc, t in zip(cells, texts)]
+                    wrote = True
+
+            # 写入日期：仅写入该表格的最后一行
+            if r_i == last_idx:
+                vi_d = find_value_cell(texts, "日期")
+                if vi_d is not None:
+                    _set_cell_text_fast(cells[vi_d], date_str)
+                    wrote = True
+                else:
+                    # 回退：若最后一行没有“日期”标签，则写入第二个单元格（若存在），否则写入第一个单元格
+                    if len(cells) >= 2:
+                        _set_cell_text_fast(cells[1], date_str)
+                    elif len(cells) >= 1:
+                        _set_cell_text_fast(cells[0], date_str)
+                    wrote = True
+    if wrote and owns_doc:
+        save_document_part(doc, doc_path)
+    return wrote
 
 
 if __name__ == "__main__":
@@ -1,10 +1,16 @@
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict
 
 from wordreportcheck.parsers.docx_parser import parse_docx_to_report
-from wordreportcheck.schemas import report_to_json
+
+try:
+    import orjson
+except ImportError:  # 可选加速依赖，未安装时回退到标准库 json
+    orjson = None
 
 
 SAMPLES_DIR = Path(__file__).resolve().parent.parent / "samples"
@@ -30,16 +36,21 @@ REQUIRED_TOP_KEYS: List[str] = [
     "签名",
     "日期",
 ]
+# 驻留后的键元组（保持声明顺序，用于报告）与集合（用于一次性差集）
+_REQUIRED_TOP_KEYS_ORDERED = tuple(sys.intern(k) for k in REQUIRED_TOP_KEYS)
+_REQUIRED_TOP_KEYS = frozenset(_REQUIRED_TOP_KEYS_ORDERED)
 
 
-def validate_json_structure(obj: Dict) -> Dict[str, List[str]]:
+def validate_json_structure(obj: Dict) -> Dict[str, Any]:
     errors: List[str] = []
     warnings: List[str] = []
+    items_empty = False
+    items_count = 0
 
-    # 顶层键存在性
-    for k in REQUIRED_TOP_KEYS:
-        if k not in obj:
-            errors.append(f"缺少顶层键: {k}")
+    # 顶层键存在性（一次集合差集；有缺失时按声明顺序报告）
+    missing = _REQUIRED_TOP_KEYS - obj.keys()
+    if missing:
+        errors.extend(f"缺少顶层键: {k}" for k in _REQUIRED_TOP_KEYS_ORDERED if k in missing)
 
     # 实验内容结构
     content = obj.get("实验内容")
@@ -50,7 +61,9 @@ def validate_json_structure(obj: Dict) -> Dict[str, List[str]]:
         if not isinstance(items, list):
             errors.append("实验内容.items 不是列表")
         else:
-            if len(items) == 0:
+            items_count = len(items)
+            if items_count == 0:
+                items_empty = True
                 warnings.append("实验内容.items 为空（可能模板未按题目X格式）")
             else:
                 # 抽样检查首条结构
@@ -59,15 +72,54 @@ def validate_json_structure(obj: Dict) -> Dict[str, List[str]]:
                     if subk not in sample:
                         errors.append(f"items[0] 缺少字段: {subk}")
 
-    return {"errors": errors, "warnings": warnings}
+    return {"errors": errors, "warnings": warnings, "items_empty": items_empty, "items_count": items_count}
+
+
+def _dumps_json_bytes(obj: Dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
 
 
 def _iter_docx_files(root: Path):
-    for p in root.rglob("*.docx"):
-        # 跳过临时文件（如 ~$ 开头）
-        if p.name.startswith("~$"):
-            continue
-        yield p
+    # 在 glob 阶段直接排除 ~ 开头的临时锁文件（如 ~$xxx.docx）
+    yield from root.rglob("[!~]*.docx")
+
+
+def _process_one(docx_path: Path) -> Dict:
+    """解析并校验单个 docx，写出镜像 JSON，返回该文件的校验结果。"""
+    try:
+        report = parse_docx_to_report(docx_path)
+        # 直接校验内存中的 JSON 对象，避免“序列化→再解析”的往返
+        obj = report.to_json_obj()
+        json_bytes = _dumps_json_bytes(obj)
+        # 在 outputs 下镜像 samples 的相对路径结构
+        rel = docx_path.relative_to(SAMPLES_DIR)
+        out_path = OUTPUTS_DIR / rel.parent / (rel.stem + ".json")
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(json_bytes)
+
+        v = validate_json_structure(obj)
+        errs = v["errors"]
+        warns = v["warnings"]
+
+        return {
+            "file": docx_path.name,
+            "status": "failed" if errs else "passed",
+            "errors": errs,
+            "warnings": warns,
+            "items_empty": v["items_empty"],
+            "items_count": v["items_count"],
+        }
+    except Exception as e:
+        return {
+            "file": docx_path.name,
+            "status": "error",
+            "errors": [str(e)],
+            "warnings": [],
+            "items_empty": False,
+            "items_count": 0,
+        }
 
 
 def main() -> int:
@@ -82,68 +134,45 @@ def main() -> int:
     passed = 0
     failed = 0
     empty_items = 0
-    results = []
-
-    for docx_path in docx_files:
-        total += 1
-        try:
-            report = parse_docx_to_report(docx_path)
-            json_str = report_to_json(report)
-            # 在 outputs 下镜像 samples 的相对路径结构
-            rel = docx_path.relative_to(SAMPLES_DIR)
-            out_path = OUTPUTS_DIR / rel.parent / (rel.stem + ".json")
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            out_path.write_text(json_str, encoding="utf-8")
-
-            obj = json.loads(json_str)
-            v = validate_json_structure(obj)
-            errs = v["errors"]
-            warns = v["warnings"]
-
-            status = "passed"
-            if errs:
-                status = "failed"
-                failed += 1
-            else:
+
+    # 各文件相互独立：多进程并行解析与校验，map 保持输入顺序。
+    # 结果逐个消费：失败与警告即时打印，只保留计数，内存占用与文件数无关
+    workers = min(len(docx_files), os.cpu_count() or 1)
+    ex = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if ex is not None:
+            chunksize = max(1, len(docx_files) // (workers * 4))
+            results = ex.map(_process_one, docx_files, chunksize=chunksize)
+        else:
+            results = map(_process_one, docx_files)
+
+        for r in results:
+            total += 1
+            if r["status"] == "passed":
                 passed += 1
-            if any("items 为空" in w for w in warns):
+            else:
+                failed += 1
+            if r["items_empty"]:
                 empty_items += 1
 
-            results.append({
-                "file": docx_path.name,
-                "status": status,
-                "errors": errs,
-                "warnings": warns,
-                "items_count": len(obj.get("实验内容", {}).get("items", []) if isinstance(obj.get("实验内容"), dict) else [])
-            })
-        except Exception as e:
-            failed += 1
-            results.append({
-                "file": docx_path.name,
-                "status": "error",
-                "errors": [str(e)],
-                "warnings": [],
-                "items_count": 0,
-            })
+            # 列出失败与警告样例
+            if r["status"] != "passed" or r["warnings"]:
+                print(f"-- {r['file']} | {r['status']} | items: {r['items_count']}")
+                for e in r["errors"]:
+                    print(f"  error: {e}")
+                for w in r["warnings"]:
+                    print(f"  warn: {w}")
+    finally:
+        if ex is not None:
+            ex.shutdown()
 
     # 汇总输出
+    print("")
     print("=== 验证汇总 ===")
     print(f"总文件数: {total}")
     print(f"结构通过: {passed}")
     print(f"结构失败: {failed}")
     print(f"content_items 为空: {empty_items}")
-    print("")
-
-    # 列出失败与警告样例
-    for r in results:
-        if r["status"] != "passed" or r["warnings"]:
-            print(f"-- {r['file']} | {r['status']} | items: {r['items_count']}")
-            if r["errors"]:
-                for e in r["errors"]:
-                    print(f"  error: {e}")
-            if r["warnings"]:
-                for w in r["warnings"]:
-                    print(f"  warn: {w}")
 
     return 0
 
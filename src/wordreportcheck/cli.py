@@ -3,17 +3,127 @@ import csv
 import json
 import os
 import sys
-import shutil
 from pathlib import Path
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from . import __version__
-from .parsers.docx_parser import parse_docx_to_report, _parse_content_items
-from .schemas import (
-    report_to_json,
-    report_from_json,
-    ReportDocument,
-)
-from .scoring.deepseek_client import score_items
+
+# 解析/评分模块（python-docx、openai 等）以及可选的 orjson 均按需导入，
+# 使 --help / --version 只需加载 argparse
+if TYPE_CHECKING:
+    from .schemas import ReportDocument
+
+
+_TRUTHY = frozenset({"1", "true", "yes", "y", "on"})
+
+
+def _dump_json(obj, fp) -> None:
+    """将 obj 以缩进 JSON 直接流式写入文件对象，不先构造完整字符串。"""
+    json.dump(obj, fp, ensure_ascii=False, indent=2)
+
+
+@lru_cache(maxsize=None)
+def _orjson():
+    """首次输出 JSON 时才导入 orjson（可选加速依赖），未安装时返回 None，由调用方回退到标准库 json。"""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def _orjson_bytes(obj) -> Optional[bytes]:
+    """安装了 orjson 时返回其序列化结果（UTF-8 字节，2 空格缩进，与标准库输出一致）；
+    未安装或遇到 orjson 不支持的值（如超出 64 位的整数）时返回 None，由调用方回退到标准库。
+    """
+    orjson = _orjson()
+    if orjson is None:
+        return None
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return None
+
+
+def _dumps_json(obj) -> str:
+    data = _orjson_bytes(obj)
+    if data is not None:
+        return data.decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+
+def _print_json(obj) -> None:
+    """将 obj 以缩进 JSON 输出到标准输出并换行。
+    有 orjson 且标准输出为 UTF-8 时直接写入底层字节流；否则用标准库流式写出，均不额外构造一份完整字符串。
+    """
+    out = sys.stdout
+    data = _orjson_bytes(obj)
+    if data is None:
+        _dump_json(obj, out)
+        out.write("\n")
+        return
+    buf = getattr(out, "buffer", None)
+    encoding = (getattr(out, "encoding", None) or "").lower().replace("-", "").replace("_", "")
+    if buf is not None and encoding == "utf8":
+        # 先冲刷文本层缓冲，保证与之前 print 的输出顺序一致
+        out.flush()
+        buf.write(data)
+        buf.write(b"\n")
+    else:
+        out.write(data.decode("utf-8"))
+        out.write("\n")
+
+
+def _write_json_file(path: Path, obj) -> None:
+    data = _orjson_bytes(obj)
+    if data is not None:
+        path.write_bytes(data)
+        return
+    with path.open("w", encoding="utf-8") as f:
+        _dump_json(obj, f)
+
+
+def _avg_score(results) -> Optional[float]:
+    """评分结果中有效分数（int/float）的平均值；单次遍历累加，没有有效分数时返回 None。"""
+    total = 0.0
+    n = 0
+    for x in results:
+        if not isinstance(x, dict):
+            continue
+        v = x.get("score")
+        if isinstance(v, (int, float)):
+            total += v
+            n += 1
+    return (total / n) if n else None
+
+
+def _failed_calls(results) -> int:
+    """评分结果中接口调用失败（带 error 标记）的题目数；这些题目只有保底分，不应计入成绩。"""
+    if not isinstance(results, list):
+        return 0
+    return sum(1 for x in results if isinstance(x, dict) and x.get("error"))
+
+
+@lru_cache(maxsize=4)
+def _parse_env_file(path_key: Tuple[str, int, int]) -> Dict[str, str]:
+    """Parse a .env file into a dict; cached per (path, mtime_ns, size) so an unchanged file is parsed once."""
+    values: Dict[str, str] = {}
+    with open(path_key[0], "r", encoding="utf-8") as f:
+        for raw in f:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export "):].strip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            # 同名键以首次出现为准，与逐行写入 os.environ 时的行为一致
+            if key and key not in values:
+                values[key] = value.strip().strip('"').strip("'")
+    return values
 
 
 def _load_env_file() -> None:
@@ -27,23 +137,17 @@ def _load_env_file() -> None:
             Path(__file__).resolve().parents[2] / ".env",
         ]
         for env_path in candidates:
-            if env_path.exists():
-                for raw in env_path.read_text(encoding="utf-8").splitlines():
-                    line = raw.strip()
-                    if not line or line.startswith("#"):
-                        continue
-                    if line.startswith("export "):
-                        line = line[len("export "):].strip()
-                    if "=" not in line:
-                        continue
-                    key, value = line.split("=", 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    # do not override existing values
-                    if key and (key not in os.environ):
-                        os.environ[key] = value
-                # only load first existing .env
-                break
+            # 直接 stat（EAFP），不存在时尝试下一个候选；stat 结果同时作为解析缓存的键
+            try:
+                st = os.stat(env_path)
+            except FileNotFoundError:
+                continue
+            values = _parse_env_file((str(env_path), st.st_mtime_ns, st.st_size))
+            for key, value in values.items():
+                # do not override existing values
+                os.environ.setdefault(key, value)
+            # only load first existing .env
+            break
     except Exception:
         # fail silently; .env is optional
         pass
@@ -63,33 +167,275 @@ def _apply_env_defaults(args: argparse.Namespace) -> None:
     env = os.environ
 
     def truthy(s: str) -> bool:
-        return s.strip().lower() in {"1", "true", "yes", "y", "on"}
+        return s.strip().lower() in _TRUTHY
 
     cmd = getattr(args, "command", None)
 
     # Common paths defaults
-    if not getattr(args, "doc", None) and env.get("WORDREPORTCHECK_DOC"):
-        setattr(args, "doc", env.get("WORDREPORTCHECK_DOC"))
-    if not getattr(args, "json", None) and env.get("WORDREPORTCHECK_JSON"):
-        setattr(args, "json", env.get("WORDREPORTCHECK_JSON"))
+    v = env.get("WORDREPORTCHECK_DOC")
+    if v and not getattr(args, "doc", None):
+        setattr(args, "doc", v)
+    v = env.get("WORDREPORTCHECK_JSON")
+    if v and not getattr(args, "json", None):
+        setattr(args, "json", v)
 
     # Only apply score-related defaults when scoring
     if cmd == "score":
         # Provider & model (env can override default values if CLI not set)
-        if env.get("WORDREPORTCHECK_PROVIDER") and getattr(args, "provider", "deepseek") == "deepseek":
-            args.provider = env.get("WORDREPORTCHECK_PROVIDER")
-        if env.get("WORDREPORTCHECK_MODEL") and getattr(args, "model", "deepseek-chat") == "deepseek-chat":
-            args.model = env.get("WORDREPORTCHECK_MODEL")
+        v = env.get("WORDREPORTCHECK_PROVIDER")
+        if v and getattr(args, "provider", "deepseek") == "deepseek":
+            args.provider = v
+        v = env.get("WORDREPORTCHECK_MODEL")
+        if v and getattr(args, "model", "deepseek-chat") == "deepseek-chat":
+            args.model = v
 
         # API key (generic fallback)
-        if not getattr(args, "api_key", None) and env.get("WORDREPORTCHECK_API_KEY"):
-            args.api_key = env.get("WORDREPORTCHECK_API_KEY")
+        v = env.get("WORDREPORTCHECK_API_KEY")
+        if v and not getattr(args, "api_key", None):
+            args.api_key = v
 
         # Flags
-        if not getattr(args, "per_item", False) and env.get("WORDREPORTCHECK_PER_ITEM"):
-            args.per_item = truthy(env.get("WORDREPORTCHECK_PER_ITEM", ""))
-        if not getattr(args, "write_back", False) and env.get("WORDREPORTCHECK_WRITE_BACK"):
-            args.write_back = truthy(env.get("WORDREPORTCHECK_WRITE_BACK", ""))
+        v = env.get("WORDREPORTCHECK_PER_ITEM")
+        if v and not getattr(args, "per_item", False):
+            args.per_item = truthy(v)
+        v = env.get("WORDREPORTCHECK_WRITE_BACK")
+        if v and not getattr(args, "write_back", False):
+            args.write_back = truthy(v)
+
+
+def _iter_docx(root: Path, recursive: bool):
+    """遍历目录下的 .docx 文件（跳过 ~$ 开头的临时锁文件）。
+    直接使用 os.scandir：文件类型取自目录项本身，无需为每个候选文件再 stat 一次。
+    根目录无法打开时抛出 OSError；无法访问的子目录与 glob 一样直接跳过。
+    """
+    root_s = os.fspath(root)
+    stack = [root_s]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            if d == root_s:
+                raise
+            continue
+        with it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(e.path)
+                    continue
+                name = e.name
+                if not name.endswith(".docx") or name.startswith("~$"):
+                    continue
+                if e.is_file():
+                    yield Path(e.path)
+
+
+def _finalize_scores(results, args, report: "ReportDocument", doc_obj=None) -> None:
+    """score 命令的收尾：按参数写回平均分（JSON/DOCX）、打印评分明细并写出 .scores.json。
+    平均分只计算一次，JSON 与 DOCX 写回共用；results 不是数组时不写回、不写出明细。
+    """
+    from .schemas import report_from_json
+
+    is_list = isinstance(results, list)
+    avg = _avg_score(results) if is_list else None
+    failed = _failed_calls(results)
+    if failed and (args.write_back or args.write_docx):
+        # 有题目的评分接口调用失败时平均分含保底分，不写回
+        print(f"❌ {failed} 个题目的评分接口调用失败（限流、超时或服务端错误），未写回成绩。")
+        avg = None
+    # 写回成绩（平均分）
+    if args.write_back and args.json:
+        if not is_list:
+            print("⚠️ 返回结果不是评分数组，未写入成绩。")
+        elif avg is not None:
+            p = Path(args.json)
+            # 重新读取输入 JSON 并只修改“成绩”：内存中的 report 可能带有本次 --segment-count
+            # 或本地分割得到的 content_items，不能写入用户的输入文件
+            rd = report_from_json(p.read_text(encoding="utf-8"))
+            rd.成绩 = f"{avg:.1f}"
+            _write_json_file(p, rd.to_json_obj())
+            print(f"✅ 已写入成绩: {rd.成绩} 至: {p}")
+        else:
+            print("⚠️ 未得到有效分数，未写入成绩。")
+    # 写回 docx（平均分），复用解析时已打开的文档
+    if args.write_docx and args.doc and avg is not None:
+        try:
+            from .parsers.docx_writer import write_grade_and_date_doc
+            ok = write_grade_and_date_doc(doc_obj, f"{avg:.1f}")
+            if ok:
+                doc_obj.save(args.doc)
+                print(f"✅ 已写回成绩到 DOCX: {args.doc}")
+            else:
+                print("⚠️ 未找到可写入的‘成绩/日期’单元格，未写入 DOCX。")
+        except Exception as e:
+            print(f"⚠️ 写回 DOCX 失败: {e}")
+    # 打印详细评分结果
+    _print_json(results)
+    # 额外：将详细评分结果写出到与原 JSON 同目录的 .scores.json
+    if args.json and is_list:
+        try:
+            src = Path(args.json)
+            out_scores = src.with_name(src.stem + ".scores.json")
+            _write_json_file(out_scores, results)
+            print(f"✅ 已写出评分明细 JSON 至: {out_scores}")
+        except Exception as e:
+            print(f"⚠️ 写出评分明细失败: {e}")
+
+
+def _auto_dir_process_one(doc_path: Path, out_dir: Path, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """auto-dir 的单文件流程：解析 ->（分割）-> 评分 -> 写回。
+    可在线程池中并发执行，因此不直接打印：日志按行收集到返回值的 "log"，由主线程按输入顺序输出。
+    返回 {"status": "processed" | "failed", "row": CSV 汇总行或 None, "log": [...]}。
+    """
+    from .parsers.docx_parser import parse_docx_to_report_with_doc, _parse_content_items
+    from .parsers.docx_writer import write_grade_and_date_streaming
+
+    log: List[str] = []
+    try:
+        # 1) 解析 DOCX -> JSON（保留已打开的文档，写回成绩时复用）
+        report, doc_obj = parse_docx_to_report_with_doc(doc_path)
+        json_path = out_dir / (doc_path.stem + ".json")
+
+        # 解析后若未有题目且指定分割数量，尝试 AI 分割
+        seg_count = opts.get("segment_count")
+        if (not report.content_items) and seg_count:
+            if not (report.实验内容原文 and report.实验内容原文.strip()):
+                log.append(f"❌ [{doc_path.name}] 未在文档中提取到‘实验内容’原文，无法进行 AI 分割。")
+                return {"status": "failed", "row": None, "log": log}
+            items = _parse_content_items(report.实验内容原文 or "", int(seg_count))
+            if len(items) != int(seg_count):
+                log.append(f"⚠️ [{doc_path.name}] 分割结果数量与期望不一致：期望 {seg_count}，实际 {len(items)}。已按规则补齐/截断。")
+            report.content_items = items
+            log.append(f"✅ [{doc_path.name}] 已通过本地规则分割得到 {len(items)} 个题目。")
+
+        # 写出解析（或分割后）的 JSON
+        try:
+            _write_json_file(json_path, report.to_json_obj())
+            log.append(f"✅ [{doc_path.name}] 已写出解析后的 JSON 至: {json_path}")
+        except Exception as e:
+            log.append(f"⚠️ [{doc_path.name}] 写出解析 JSON 失败: {e}")
+
+        # 2) 评分
+        items = report.content_items or []
+        if not items:
+            log.append(f"❌ [{doc_path.name}] 未在文档的‘实验内容’中识别到题目，且未进行 AI 分割。")
+            row = {
+                "文件名": doc_path.name,
+                "姓名": (report.姓名 or ""),
+                "学号": (report.学号 or ""),
+                "班级": (report.班级 or ""),
+                "课程名称": (report.课程名称 or ""),
+                "实验名称": (report.实验名称 or ""),
+                "成绩": ""
+            }
+            return {"status": "failed", "row": row, "log": log}
+
+        provider = opts["provider"]
+        model = opts["model"]
+        api_key = opts["api_key"]
+        if not api_key:
+            if provider == "deepseek":
+                log.append(f"❌ [{doc_path.name}] 未找到 DeepSeek API Key。请设置环境变量 DEEPSEEK_API_KEY 或 WORDREPORTCHECK_API_KEY。")
+            else:
+                log.append(f"❌ [{doc_path.name}] 未找到 Kimi/Moonshot API Key。请设置环境变量 MOONSHOT_API_KEY 或 WORDREPORTCHECK_API_KEY。")
+            row = {
+                "文件名": doc_path.name,
+                "姓名": (report.姓名 or ""),
+                "学号": (report.学号 or ""),
+                "班级": (report.班级 or ""),
+                "课程名称": (report.课程名称 or ""),
+                "实验名称": (report.实验名称 or ""),
+                "成绩": ""
+            }
+            return {"status": "failed", "row": row, "log": log}
+
+        results = opts["score_items"](items, api_key=api_key, model=model, use_cache=opts["use_cache"])
+
+        # 3) 写出评分明细
+        scores_path = out_dir / (doc_path.stem + ".scores.json")
+        try:
+            _write_json_file(scores_path, results)
+            log.append(f"✅ [{doc_path.name}] 已写出评分明细 JSON 至: {scores_path}")
+        except Exception as e:
+            log.append(f"⚠️ [{doc_path.name}] 写出评分明细失败: {e}")
+
+        # 有题目的评分接口调用失败时，该文档视为失败：平均分含保底分，不写入成绩
+        failed_calls = _failed_calls(results)
+        if failed_calls:
+            log.append(f"❌ [{doc_path.name}] {failed_calls} 个题目的评分接口调用失败（限流、超时或服务端错误），未写入成绩。")
+            row = {
+                "文件名": doc_path.name,
+                "姓名": (report.姓名 or ""),
+                "学号": (report.学号 or ""),
+                "班级": (report.班级 or ""),
+                "课程名称": (report.课程名称 or ""),
+                "实验名称": (report.实验名称 or ""),
+                "成绩": ""
+            }
+            return {"status": "failed", "row": row, "log": log}
+
+        # 4) 计算平均分并写回 JSON
+        avg = _avg_score(results) if isinstance(results, list) else None
+        if avg is not None:
+            try:
+                # 解析 JSON 刚由内存中的 report 写出，直接更新后重写，无需回读
+                report.成绩 = f"{avg:.1f}"
+                _write_json_file(json_path, report.to_json_obj())
+                log.append(f"✅ [{doc_path.name}] 已在解析 JSON 写入成绩: {report.成绩} -> {json_path}")
+            except Exception as e:
+                log.append(f"⚠️ [{doc_path.name}] 写入成绩到解析 JSON 失败: {e}")
+        else:
+            log.append(f"⚠️ [{doc_path.name}] 未得到有效分数，未在解析 JSON 写入‘成绩’。")
+
+        # 5) 将平均分写回到复制后的 DOCX（不修改源文件）
+        if avg is not None:
+            try:
+                out_docx = out_dir / doc_path.name
+                try:
+                    ok = write_grade_and_date_streaming(doc_path, out_docx, f"{avg:.1f}", doc=doc_obj)
+                except Exception as e:
+                    log.append(f"⚠️ [{doc_path.name}] 复制 DOCX 到输出目录失败: {e}")
+                    return {"status": "failed", "row": None, "log": log}
+                if ok:
+                    log.append(f"✅ [{doc_path.name}] 已写回成绩到输出 DOCX: {out_docx}")
+                else:
+                    log.append(f"⚠️ [{doc_path.name}] 未找到可写入的‘成绩/日期’单元格，未写入 DOCX。")
+            except Exception as e:
+                log.append(f"⚠️ [{doc_path.name}] 写回 DOCX 失败: {e}")
+
+        # 6) 打印简要总结（逐份）
+        summary = {
+            "doc": str(doc_path),
+            "doc_out": str(out_dir / doc_path.name),
+            "json": str(json_path),
+            "scores_json": str(scores_path),
+            "provider": provider,
+            "model": model,
+            "average_score": None if avg is None else float(f"{avg:.1f}")
+        }
+        log.append(_dumps_json(summary))
+        # 加入 CSV 汇总行
+        row = {
+            "姓名": (report.姓名 or ""),
+            "学号": (report.学号 or ""),
+            "班级": (report.班级 or ""),
+            "课程名称": (report.课程名称 or ""),
+            "实验名称": (report.实验名称 or ""),
+            "成绩": ("" if avg is None else f"{avg:.1f}")
+        }
+        return {"status": "processed", "row": row, "log": log}
+    except Exception as e:
+        log.append(f"❌ [{doc_path.name}] 处理失败: {e}")
+        return {"status": "failed", "row": None, "log": log}
+
+
+def _auto_dir_process_group(group: List[Path], out_dir: Path, opts: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按顺序串行处理一组输出路径相同的文件（见 auto-dir 的分组），返回各文件的处理结果。"""
+    return [_auto_dir_process_one(doc_path, out_dir, opts) for doc_path in group]
+
+
+_COMMANDS = ("parse", "score", "write-docx", "auto", "auto-dir")
 
 
 def main() -> int:
@@ -106,56 +452,72 @@ def main() -> int:
 
     subparsers = parser.add_subparsers(dest="command")
 
-    parse_parser = subparsers.add_parser("parse", help="解析 docx 文档为包含18个单元的 JSON")
-    parse_parser.add_argument("--doc", required=True, help="docx 文档路径")
-    parse_parser.add_argument("--out", required=False, help="输出 JSON 文件路径（默认打印到控制台）")
-    # 可选：将实验内容原文交给 AI 分割为指定题目数量
-    parse_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选；必须与模型输出一致）")
-    parse_parser.add_argument("--provider", choices=["deepseek", "kimi"], default="deepseek", help="选择分割服务提供者：deepseek 或 kimi")
-    parse_parser.add_argument("--api-key", required=False, help="分割服务 API Key（可选，未提供则读取环境变量）")
-    parse_parser.add_argument("--model", required=False, default="deepseek-chat", help="分割模型，deepseek默认为 deepseek-chat，kimi默认为 moonshot-v1-128k")
-
-    score_parser = subparsers.add_parser("score", help="解析并提交到评分服务进行评分（仅评分实验内容中的题目）")
-    score_parser.add_argument("--doc", required=False, help="docx 文档路径（与 --json 二选一）")
-    score_parser.add_argument("--json", required=False, help="已解析的 JSON 文件路径（与 --doc 二选一）")
-    score_parser.add_argument("--api-key", required=False, help="DeepSeek API Key（默认读取环境变量 DEEPSEEK_API_KEY）")
-    score_parser.add_argument("--model", required=False, default="deepseek-chat", help="评分模型，deepseek默认为 deepseek-chat，kimi默认为 moonshot-v1-128k")
-    score_parser.add_argument("--per-item", action="store_true", help="逐题提交评分（每题单独请求）")
-    score_parser.add_argument("--write-back", action="store_true", help="将平均分写入到 JSON 的“成绩”字段（仅在 --json 时生效）")
-    score_parser.add_argument("--provider", choices=["deepseek", "kimi"], default="deepseek", help="选择评分服务提供者：deepseek 或 kimi")
-    score_parser.add_argument("--write-docx", action="store_true", help="将平均分写回到 docx 文档的“成绩/日期”单元格（仅在 --doc 时生效）")
-    # 可选：若未识别题目，可先进行 AI 分割
-    score_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选；必须与模型输出一致）")
-
-    # 新增：从 JSON 写回成绩到 DOCX（必须在 parse_args 之前注册）
-    write_docx_parser = subparsers.add_parser("write-docx", help="将 JSON 中的‘成绩’写回到 DOCX 的‘成绩/日期’单元格")
-    write_docx_parser.add_argument("--doc", required=False, help="docx 文档路径（必填）")
-    write_docx_parser.add_argument("--json", required=False, help="JSON 文件路径（必填，用于读取成绩）")
-
-    # 新增：一键执行命令（解析 -> 评分 -> 写回）
-    auto_parser = subparsers.add_parser(
-        "auto",
-        help="一键解析 DOCX、评分并写回成绩，同时输出 JSON 和评分明细"
-    )
-    auto_parser.add_argument("--doc", required=True, help="docx 文档路径（必填）")
-    auto_parser.add_argument("--api-key", required=False, help="评分服务 API Key（可选，未提供则读取环境变量）")
-    auto_parser.add_argument("--out-dir", required=False, help="输出目录（用于存放解析 JSON 与评分明细 JSON）")
-    # 新增：当未识别题目时，允许在 auto 流程中进行 AI 分割
-    auto_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选，默认 6）")
-    auto_parser.add_argument("--provider", choices=["deepseek", "kimi"], required=False, help="选择服务提供者（覆盖环境变量）")
-
-    # 批量执行：遍历目录下的所有 .docx 并逐个运行 auto
-    auto_dir_parser = subparsers.add_parser(
-        "auto-dir",
-        help="批量执行 auto：遍历目录下的所有 .docx 并输出到指定目录"
-    )
-    auto_dir_parser.add_argument("--in-dir", required=True, help="输入目录（遍历其中的 .docx 文件）")
-    auto_dir_parser.add_argument("--out-dir", required=True, help="输出目录（解析 JSON、评分明细及写回 DOCX 将写入此目录）")
-    auto_dir_parser.add_argument("--api-key", required=False, help="评分服务 API Key（可选，未提供则读取环境变量）")
-    auto_dir_parser.add_argument("--recursive", action="store_true", help="是否递归遍历子目录")
-    # 新增：允许在批量模式下进行 AI 分割，指定题目数量
-    auto_dir_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选）")
-    auto_dir_parser.add_argument("--provider", choices=["deepseek", "kimi"], required=False, help="选择服务提供者（覆盖环境变量）")
+    # 只注册本次调用的子命令（--version、-h 或未知命令时注册全部，保证帮助与报错信息完整），
+    # 省去无关子命令的参数构造
+    argv = sys.argv[1:]
+    cmd = argv[0] if argv and not argv[0].startswith("-") else None
+    if cmd not in _COMMANDS:
+        cmd = None
+
+    if cmd in (None, "parse"):
+        parse_parser = subparsers.add_parser("parse", help="解析 docx 文档为包含18个单元的 JSON")
+        parse_parser.add_argument("--doc", required=True, help="docx 文档路径")
+        parse_parser.add_argument("--out", required=False, help="输出 JSON 文件路径（默认打印到控制台）")
+        # 可选：将实验内容原文交给 AI 分割为指定题目数量
+        parse_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选；必须与模型输出一致）")
+        parse_parser.add_argument("--provider", choices=["deepseek", "kimi"], default="deepseek", help="选择分割服务提供者：deepseek 或 kimi")
+        parse_parser.add_argument("--api-key", required=False, help="分割服务 API Key（可选，未提供则读取环境变量）")
+        parse_parser.add_argument("--model", required=False, default="deepseek-chat", help="分割模型，deepseek默认为 deepseek-chat，kimi默认为 moonshot-v1-128k")
+        parse_parser.add_argument("--no-cache", action="store_true", help="不使用解析缓存，总是重新解析 DOCX")
+
+    if cmd in (None, "score"):
+        score_parser = subparsers.add_parser("score", help="解析并提交到评分服务进行评分（仅评分实验内容中的题目）")
+        score_parser.add_argument("--doc", required=False, help="docx 文档路径（与 --json 二选一）")
+        score_parser.add_argument("--json", required=False, help="已解析的 JSON 文件路径（与 --doc 二选一）")
+        score_parser.add_argument("--api-key", required=False, help="DeepSeek API Key（默认读取环境变量 DEEPSEEK_API_KEY）")
+        score_parser.add_argument("--model", required=False, default="deepseek-chat", help="评分模型，deepseek默认为 deepseek-chat，kimi默认为 moonshot-v1-128k")
+        score_parser.add_argument("--per-item", action="store_true", help="逐题提交评分（每题单独请求）")
+        score_parser.add_argument("--write-back", action="store_true", help="将平均分写入到 JSON 的“成绩”字段（仅在 --json 时生效）")
+        score_parser.add_argument("--provider", choices=["deepseek", "kimi"], default="deepseek", help="选择评分服务提供者：deepseek 或 kimi")
+        score_parser.add_argument("--write-docx", action="store_true", help="将平均分写回到 docx 文档的“成绩/日期”单元格（仅在 --doc 时生效）")
+        # 可选：若未识别题目，可先进行 AI 分割
+        score_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选；必须与模型输出一致）")
+        score_parser.add_argument("--no-cache", action="store_true", help="不使用缓存：总是重新解析 DOCX（仅在 --doc 时生效），并总是重新请求评分")
+
+    if cmd in (None, "write-docx"):
+        # 新增：从 JSON 写回成绩到 DOCX（必须在 parse_args 之前注册）
+        write_docx_parser = subparsers.add_parser("write-docx", help="将 JSON 中的‘成绩’写回到 DOCX 的‘成绩/日期’单元格")
+        write_docx_parser.add_argument("--doc", required=False, help="docx 文档路径（必填）")
+        write_docx_parser.add_argument("--json", required=False, help="JSON 文件路径（必填，用于读取成绩）")
+
+    if cmd in (None, "auto"):
+        # 新增：一键执行命令（解析 -> 评分 -> 写回）
+        auto_parser = subparsers.add_parser(
+            "auto",
+            help="一键解析 DOCX、评分并写回成绩，同时输出 JSON 和评分明细"
+        )
+        auto_parser.add_argument("--doc", required=True, help="docx 文档路径（必填）")
+        auto_parser.add_argument("--api-key", required=False, help="评分服务 API Key（可选，未提供则读取环境变量）")
+        auto_parser.add_argument("--out-dir", required=False, help="输出目录（用于存放解析 JSON 与评分明细 JSON）")
+        # 新增：当未识别题目时，允许在 auto 流程中进行 AI 分割
+        auto_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选，默认 6）")
+        auto_parser.add_argument("--provider", choices=["deepseek", "kimi"], required=False, help="选择服务提供者（覆盖环境变量）")
+        auto_parser.add_argument("--no-cache", action="store_true", help="不使用评分缓存，总是重新请求评分")
+
+    if cmd in (None, "auto-dir"):
+        # 批量执行：遍历目录下的所有 .docx 并逐个运行 auto
+        auto_dir_parser = subparsers.add_parser(
+            "auto-dir",
+            help="批量执行 auto：遍历目录下的所有 .docx 并输出到指定目录"
+        )
+        auto_dir_parser.add_argument("--in-dir", required=True, help="输入目录（遍历其中的 .docx 文件）")
+        auto_dir_parser.add_argument("--out-dir", required=True, help="输出目录（解析 JSON、评分明细及写回 DOCX 将写入此目录）")
+        auto_dir_parser.add_argument("--api-key", required=False, help="评分服务 API Key（可选，未提供则读取环境变量）")
+        auto_dir_parser.add_argument("--recursive", action="store_true", help="是否递归遍历子目录")
+        # 新增：允许在批量模式下进行 AI 分割，指定题目数量
+        auto_dir_parser.add_argument("--segment-count", type=int, required=False, help="AI 分割题目数量（可选）")
+        auto_dir_parser.add_argument("--provider", choices=["deepseek", "kimi"], required=False, help="选择服务提供者（覆盖环境变量）")
+        auto_dir_parser.add_argument("--no-cache", action="store_true", help="不使用评分缓存，总是重新请求评分")
 
     # 先加载 .env，使其中的变量对后续读取生效
     _load_env_file()
@@ -164,8 +526,13 @@ def main() -> int:
     _apply_env_defaults(args)
 
     if args.command == "parse":
+        from .parsers.docx_parser import parse_docx_to_report, parse_docx_to_report_cached, _parse_content_items
+
         doc_path = Path(args.doc)
-        report: ReportDocument = parse_docx_to_report(doc_path)
+        if args.no_cache:
+            report: "ReportDocument" = parse_docx_to_report(doc_path)
+        else:
+            report = parse_docx_to_report_cached(doc_path)
         # 若指定分割数量，则使用本地规则按题目进行分割
         if getattr(args, "segment_count", None):
             if not (report.实验内容原文 and report.实验内容原文.strip()):
@@ -176,19 +543,27 @@ def main() -> int:
                 print(f"⚠️ 分割结果数量与期望不一致：期望 {args.segment_count}，实际 {len(items)}。已按规则补齐/截断。")
             report.content_items = items
             print(f"✅ 已按文档规则分割为 {len(items)} 个题目。")
-        json_str = report_to_json(report)
         if args.out:
             out_path = Path(args.out)
-            out_path.write_text(json_str, encoding="utf-8")
+            _write_json_file(out_path, report.to_json_obj())
             print(f"✅ 已写出 JSON 至: {out_path}")
         else:
-            print(json_str)
+            _print_json(report.to_json_obj())
         return 0
 
     if args.command == "score":
-        report: ReportDocument = None  # type: ignore
+        from .parsers.docx_parser import parse_docx_to_report_with_doc, parse_docx_to_report_cached, _parse_content_items
+        from .schemas import report_from_json
+
+        report: "ReportDocument" = None  # type: ignore
+        # 由 --doc 解析时保留已打开的文档，--write-docx 写回时复用
+        doc_obj = None
         if args.doc:
-            report = parse_docx_to_report(Path(args.doc))
+            if args.write_docx or args.no_cache:
+                report, doc_obj = parse_docx_to_report_with_doc(Path(args.doc))
+            else:
+                # 不写回 DOCX 时无需打开的文档，可直接使用解析缓存
+                report = parse_docx_to_report_cached(Path(args.doc))
         elif args.json:
             report = report_from_json(Path(args.json).read_text(encoding="utf-8"))
         else:
@@ -238,123 +613,60 @@ def main() -> int:
                 from .scoring.deepseek_client import score_item
             else:
                 from .scoring.kimi_client import score_item
-            all_results = []
-            for it in items:
-                r = score_item(it, api_key=api_key, model=model)
-                all_results.append(r)
-            # 写回成绩（平均分）
-            if args.write_back and args.json:
-                # 统计有效分数
-                scores = [x.get("score") for x in all_results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-                avg = sum(scores) / len(scores) if scores else None
-                if avg is not None:
-                    p = Path(args.json)
-                    rd = report_from_json(p.read_text(encoding="utf-8"))
-                    rd.成绩 = f"{avg:.1f}"
-                    p.write_text(report_to_json(rd), encoding="utf-8")
-                    print(f"✅ 已写入成绩: {rd.成绩} 至: {p}")
-                else:
-                    print("⚠️ 未得到有效分数，未写入成绩。")
-            # 写回 docx（平均分）
-            if args.write_docx and args.doc:
-                scores = [x.get("score") for x in all_results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-                avg = sum(scores) / len(scores) if scores else None
-                if avg is not None:
-                    try:
-                        from .parsers.docx_writer import write_grade_and_date
-                        ok = write_grade_and_date(Path(args.doc), f"{avg:.1f}")
-                        if ok:
-                            print(f"✅ 已写回成绩到 DOCX: {args.doc}")
-                        else:
-                            print("⚠️ 未找到可写入的‘成绩/日期’单元格，未写入 DOCX。")
-                    except Exception as e:
-                        print(f"⚠️ 写回 DOCX 失败: {e}")
-            # 打印详细评分结果
-            print(json.dumps(all_results, ensure_ascii=False, indent=2))
-            # 额外：将详细评分结果写出到与原 JSON 同目录的 .scores.json
-            if args.json:
-                try:
-                    src = Path(args.json)
-                    out_scores = src.with_name(src.stem + ".scores.json")
-                    out_scores.write_text(json.dumps(all_results, ensure_ascii=False, indent=2), encoding="utf-8")
-                    print(f"✅ 已写出评分明细 JSON 至: {out_scores}")
-                except Exception as e:
-                    print(f"⚠️ 写出评分明细失败: {e}")
+            from .scoring.common import parallel_score
+
+            all_results = parallel_score(score_item, items, api_key=api_key, model=model, use_cache=not args.no_cache)
+            _finalize_scores(all_results, args, report, doc_obj)
         else:
             if provider == "deepseek":
                 from .scoring.deepseek_client import score_items
             else:
                 from .scoring.kimi_client import score_items
-            results = score_items(items, api_key=api_key, model=model)
-            # 写回成绩（平均分）
-            if args.write_back and args.json:
-                # results 期望是数组；若为其他格式则不写回
-                if isinstance(results, list):
-                    scores = [x.get("score") for x in results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-                    avg = sum(scores) / len(scores) if scores else None
-                    if avg is not None:
-                        p = Path(args.json)
-                        rd = report_from_json(p.read_text(encoding="utf-8"))
-                        rd.成绩 = f"{avg:.1f}"
-                        p.write_text(report_to_json(rd), encoding="utf-8")
-                        print(f"✅ 已写入成绩: {rd.成绩} 至: {p}")
-                    else:
-                        print("⚠️ 未得到有效分数，未写入成绩。")
-                else:
-                    print("⚠️ 返回结果不是评分数组，未写入成绩。")
-            # 写回 docx（平均分）
-            if args.write_docx and args.doc and isinstance(results, list):
-                scores = [x.get("score") for x in results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-                avg = sum(scores) / len(scores) if scores else None
-                if avg is not None:
-                    try:
-                        from .parsers.docx_writer import write_grade_and_date
-                        ok = write_grade_and_date(Path(args.doc), f"{avg:.1f}")
-                        if ok:
-                            print(f"✅ 已写回成绩到 DOCX: {args.doc}")
-                        else:
-                            print("⚠️ 未找到可写入的‘成绩/日期’单元格，未写入 DOCX。")
-                    except Exception as e:
-                        print(f"⚠️ 写回 DOCX 失败: {e}")
-            # 打印详细评分结果
-            print(json.dumps(results, ensure_ascii=False, indent=2))
-            # 额外：将详细评分结果写出到与原 JSON 同目录的 .scores.json
-            if args.json and isinstance(results, list):
-                try:
-                    src = Path(args.json)
-                    out_scores = src.with_name(src.stem + ".scores.json")
-                    out_scores.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
-                    print(f"✅ 已写出评分明细 JSON 至: {out_scores}")
-                except Exception as e:
-                    print(f"⚠️ 写出评分明细失败: {e}")
+            results = score_items(items, api_key=api_key, model=model, use_cache=not args.no_cache)
+            _finalize_scores(results, args, report, doc_obj)
         return 0
 
     if args.command == "auto":
+        from .parsers.docx_parser import parse_docx_to_report_with_doc, _parse_content_items
+        from docx.opc.exceptions import PackageNotFoundError
+
+        # 命令参数在分支开头一次性读入局部变量
+        out_dir_arg = getattr(args, "out_dir", None)
+        seg_count_arg = getattr(args, "segment_count", None)
+        api_key_arg = getattr(args, "api_key", None)
+
         # 1) 解析 DOCX -> JSON 并写出到目标输出目录（默认与 DOCX 同目录）
         doc_path = Path(args.doc)
-        if not doc_path.exists():
-            print(f"❌ 未找到 DOCX 文件: {doc_path}")
+        # 直接解析（EAFP），打开失败时才检查文件是否存在，以区分“文件不存在”与“文件损坏/不是 DOCX”
+        try:
+            report, doc_obj = parse_docx_to_report_with_doc(doc_path)
+        except (FileNotFoundError, PackageNotFoundError):
+            if not doc_path.exists():
+                print(f"❌ 未找到 DOCX 文件: {doc_path}")
+            else:
+                print(f"❌ 无法打开 DOCX 文件（文件已损坏或不是有效的 .docx）: {doc_path}")
             return 2
-        out_dir = Path(getattr(args, "out_dir", "")) if getattr(args, "out_dir", None) else doc_path.parent
+        out_dir = Path(out_dir_arg) if out_dir_arg else doc_path.parent
         try:
             out_dir.mkdir(parents=True, exist_ok=True)
         except Exception as e:
             print(f"❌ 创建输出目录失败: {out_dir}，错误: {e}")
             return 2
-        report: ReportDocument = parse_docx_to_report(doc_path)
-        json_str = report_to_json(report)
         json_path = out_dir / (doc_path.stem + ".json")
-        try:
-            json_path.write_text(json_str, encoding="utf-8")
-            print(f"✅ 已写出解析后的 JSON 至: {json_path}")
-        except Exception as e:
-            print(f"⚠️ 写出解析 JSON 失败: {e}")
+        items = report.content_items or []
+        # 随后要进行分割时，解析 JSON 只在分割完成后序列化并写出一次
+        will_split = (not items) and bool((report.实验内容原文 or "").strip())
+        if not will_split:
+            try:
+                _write_json_file(json_path, report.to_json_obj())
+                print(f"✅ 已写出解析后的 JSON 至: {json_path}")
+            except Exception as e:
+                print(f"⚠️ 写出解析 JSON 失败: {e}")
 
         # 2) 若未识别到题目，则尝试 AI 分割（支持 --segment-count 或环境变量，默认 6）
-        items = report.content_items or []
         if not items:
             env = os.environ
-            seg_count = getattr(args, "segment_count", None)
+            seg_count = seg_count_arg
             if not seg_count:
                 # 从环境读取，默认 6
                 try:
@@ -368,9 +680,8 @@ def main() -> int:
             if len(items) != int(seg_count):
                 print(f"⚠️ 分割结果数量与期望不一致：期望 {seg_count}，实际 {len(items)}。已按规则补齐/截断。")
             report.content_items = items
-            json_str = report_to_json(report)
             try:
-                json_path.write_text(json_str, encoding="utf-8")
+                _write_json_file(json_path, report.to_json_obj())
                 print(f"✅ 已通过本地规则分割得到 {len(items)} 个题目，并写出解析后的 JSON 至: {json_path}")
             except Exception as e:
                 print(f"⚠️ 写出解析 JSON 失败: {e}")
@@ -378,7 +689,6 @@ def main() -> int:
         # 读取 Provider/Model/API Key（无需命令行参数，尽量简化）
         env = os.environ
         provider = (env.get("WORDREPORTCHECK_PROVIDER") or "deepseek").strip().lower()
-        api_key_arg = getattr(args, "api_key", None)
 
         # 先根据当前 provider 读取对应的 key
         if provider == "deepseek":
@@ -388,12 +698,14 @@ def main() -> int:
 
         # 若未找到 key，则尝试根据存在的密钥自动切换 provider
         if not api_key:
-            if env.get("MOONSHOT_API_KEY"):
+            moonshot_key = env.get("MOONSHOT_API_KEY")
+            deepseek_key = env.get("DEEPSEEK_API_KEY")
+            if moonshot_key:
                 provider = "kimi"
-                api_key = env.get("MOONSHOT_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
-            elif env.get("DEEPSEEK_API_KEY"):
+                api_key = moonshot_key
+            elif deepseek_key:
                 provider = "deepseek"
-                api_key = env.get("DEEPSEEK_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
+                api_key = deepseek_key
 
         # 模型选择在最终 provider 决定后进行
         model_env = env.get("WORDREPORTCHECK_MODEL")
@@ -417,27 +729,29 @@ def main() -> int:
             from .scoring.deepseek_client import score_items as _score_items
         else:
             from .scoring.kimi_client import score_items as _score_items
-        results = _score_items(items, api_key=api_key, model=model)
+        results = _score_items(items, api_key=api_key, model=model, use_cache=not args.no_cache)
 
         # 3) 写出评分明细至与解析 JSON 同目录的 .scores.json
         scores_path = out_dir / (doc_path.stem + ".scores.json")
         try:
-            scores_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+            _write_json_file(scores_path, results)
             print(f"✅ 已写出评分明细 JSON 至: {scores_path}")
         except Exception as e:
             print(f"⚠️ 写出评分明细失败: {e}")
 
+        failed_calls = _failed_calls(results)
+        if failed_calls:
+            print(f"❌ {failed_calls} 个题目的评分接口调用失败（限流、超时或服务端错误），未写入成绩。")
+            return 2
+
         # 4) 计算平均分，写回解析 JSON 的‘成绩’字段
-        avg = None
-        if isinstance(results, list):
-            valid_scores = [x.get("score") for x in results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-            avg = (sum(valid_scores) / len(valid_scores)) if valid_scores else None
+        avg = _avg_score(results) if isinstance(results, list) else None
         if avg is not None:
             try:
-                rd = report_from_json(json_path.read_text(encoding="utf-8"))
-                rd.成绩 = f"{avg:.1f}"
-                json_path.write_text(report_to_json(rd), encoding="utf-8")
-                print(f"✅ 已在解析 JSON 写入成绩: {rd.成绩} -> {json_path}")
+                # 解析 JSON 刚由内存中的 report 写出，直接更新后重写，无需回读
+                report.成绩 = f"{avg:.1f}"
+                _write_json_file(json_path, report.to_json_obj())
+                print(f"✅ 已在解析 JSON 写入成绩: {report.成绩} -> {json_path}")
             except Exception as e:
                 print(f"⚠️ 写入成绩到解析 JSON 失败: {e}")
         else:
@@ -446,16 +760,14 @@ def main() -> int:
         # 5) 将平均分写回到 DOCX 的‘成绩/日期’单元格（不修改源文件，复制到输出目录后写回）
         if avg is not None:
             try:
-                from .parsers.docx_writer import write_grade_and_date
-                # 复制源 DOCX 到输出目录
+                from .parsers.docx_writer import write_grade_and_date_streaming
+                # 复用解析时打开的文档写回成绩，输出到输出目录（仅重写主文档部件）
                 out_docx = out_dir / doc_path.name
                 try:
-                    shutil.copy2(doc_path, out_docx)
+                    ok = write_grade_and_date_streaming(doc_path, out_docx, f"{avg:.1f}", doc=doc_obj)
                 except Exception as e:
                     print(f"⚠️ 复制 DOCX 到输出目录失败: {e}")
                     return 2
-                # 在复制的 DOCX 上写回成绩
-                ok = write_grade_and_date(out_docx, f"{avg:.1f}")
                 if ok:
                     print(f"✅ 已写回成绩到输出 DOCX: {out_docx}")
                 else:
@@ -473,14 +785,29 @@ def main() -> int:
             "model": model,
             "average_score": None if avg is None else float(f"{avg:.1f}")
         }
-        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        _print_json(summary)
         return 0
 
     if args.command == "auto-dir":
+        from concurrent.futures import ThreadPoolExecutor
+
+        # 命令参数在分支开头一次性读入局部变量
+        recursive_arg = getattr(args, "recursive", False)
+        seg_count_arg = getattr(args, "segment_count", None)
+        provider_arg = getattr(args, "provider", None)
+        api_key_arg = getattr(args, "api_key", None)
+
         in_dir = Path(args.in_dir)
-        if not in_dir.exists() or not in_dir.is_dir():
+
+        # 收集待处理的 DOCX 文件。不预先检查目录是否存在：打开目录失败即视为目录不可用
+        try:
+            docs = list(_iter_docx(in_dir, recursive_arg))
+        except OSError:
             print(f"❌ 输入目录不存在或不可用: {in_dir}")
             return 2
+        if not docs:
+            print("⚠️ 目录中未找到 .docx 文件（已忽略临时锁文件 ~$ 开头）。")
+            return 0
         out_dir = Path(args.out_dir)
         try:
             out_dir.mkdir(parents=True, exist_ok=True)
@@ -488,185 +815,101 @@ def main() -> int:
             print(f"❌ 创建输出目录失败: {out_dir}，错误: {e}")
             return 2
 
-        # 收集待处理的 DOCX 文件
-        iterator = in_dir.rglob("*.docx") if getattr(args, "recursive", False) else in_dir.glob("*.docx")
-        docs = [p for p in iterator if p.is_file() and not p.name.startswith("~$")]
-        if not docs:
-            print("⚠️ 目录中未找到 .docx 文件（已忽略临时锁文件 ~$ 开头）。")
-            return 0
-
         total = 0
         failed = 0
-        csv_rows = []
-        for doc_path in docs:
-            try:
-                # 1) 解析 DOCX -> JSON
-                report: ReportDocument = parse_docx_to_report(doc_path)
-                json_path = out_dir / (doc_path.stem + ".json")
-
-                # 解析后若未有题目且指定分割数量，尝试 AI 分割
-                seg_count = getattr(args, "segment_count", None)
-                if (not report.content_items) and seg_count:
-                    if not (report.实验内容原文 and report.实验内容原文.strip()):
-                        print(f"❌ [{doc_path.name}] 未在文档中提取到‘实验内容’原文，无法进行 AI 分割。")
-                        failed += 1
-                        continue
-                    items = _parse_content_items(report.实验内容原文 or "", int(seg_count))
-                    if len(items) != int(seg_count):
-                        print(f"⚠️ [{doc_path.name}] 分割结果数量与期望不一致：期望 {seg_count}，实际 {len(items)}。已按规则补齐/截断。")
-                    report.content_items = items
-                    print(f"✅ [{doc_path.name}] 已通过本地规则分割得到 {len(items)} 个题目。")
-
-                # 写出解析（或分割后）的 JSON
-                json_str = report_to_json(report)
-                try:
-                    json_path.write_text(json_str, encoding="utf-8")
-                    print(f"✅ [{doc_path.name}] 已写出解析后的 JSON 至: {json_path}")
-                except Exception as e:
-                    print(f"⚠️ [{doc_path.name}] 写出解析 JSON 失败: {e}")
-
-                # 2) 评分
-                items = report.content_items or []
-                if not items:
-                    print(f"❌ [{doc_path.name}] 未在文档的‘实验内容’中识别到题目，且未进行 AI 分割。")
-                    csv_rows.append({
-                        "文件名": doc_path.name,
-                        "姓名": (report.姓名 or ""),
-                        "学号": (report.学号 or ""),
-                        "班级": (report.班级 or ""),
-                        "课程名称": (report.课程名称 or ""),
-                        "实验名称": (report.实验名称 or ""),
-                        "成绩": ""
-                    })
-                    failed += 1
-                    continue
-
-                env = os.environ
-                provider = (getattr(args, "provider", None) or env.get("WORDREPORTCHECK_PROVIDER") or "deepseek").strip().lower()
-                api_key_arg = getattr(args, "api_key", None)
-                if provider == "deepseek":
-                    api_key = api_key_arg or env.get("DEEPSEEK_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
-                else:
-                    api_key = api_key_arg or env.get("MOONSHOT_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
-                if not api_key:
-                    if env.get("MOONSHOT_API_KEY"):
-                        provider = "kimi"
-                        api_key = env.get("MOONSHOT_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
-                    elif env.get("DEEPSEEK_API_KEY"):
-                        provider = "deepseek"
-                        api_key = env.get("DEEPSEEK_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
-
-                model_env = env.get("WORDREPORTCHECK_MODEL")
-                if model_env:
-                    model = model_env
-                else:
-                    model = "deepseek-chat" if provider == "deepseek" else "moonshot-v1-128k"
-                if provider == "kimi" and model == "deepseek-chat":
-                    model = "moonshot-v1-128k"
+        # 提供者、密钥与模型与具体文件无关：循环前解析一次，评分函数预先绑定
+        env = os.environ
+        provider = (provider_arg or env.get("WORDREPORTCHECK_PROVIDER") or "deepseek").strip().lower()
+        if provider == "deepseek":
+            api_key = api_key_arg or env.get("DEEPSEEK_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
+        else:
+            api_key = api_key_arg or env.get("MOONSHOT_API_KEY") or env.get("WORDREPORTCHECK_API_KEY")
+        if not api_key:
+            moonshot_key = env.get("MOONSHOT_API_KEY")
+            deepseek_key = env.get("DEEPSEEK_API_KEY")
+            if moonshot_key:
+                provider = "kimi"
+                api_key = moonshot_key
+            elif deepseek_key:
+                provider = "deepseek"
+                api_key = deepseek_key
 
-                if not api_key:
-                    if provider == "deepseek":
-                        print(f"❌ [{doc_path.name}] 未找到 DeepSeek API Key。请设置环境变量 DEEPSEEK_API_KEY 或 WORDREPORTCHECK_API_KEY。")
-                    else:
-                        print(f"❌ [{doc_path.name}] 未找到 Kimi/Moonshot API Key。请设置环境变量 MOONSHOT_API_KEY 或 WORDREPORTCHECK_API_KEY。")
-                    csv_rows.append({
-                        "文件名": doc_path.name,
-                        "姓名": (report.姓名 or ""),
-                        "学号": (report.学号 or ""),
-                        "班级": (report.班级 or ""),
-                        "课程名称": (report.课程名称 or ""),
-                        "实验名称": (report.实验名称 or ""),
-                        "成绩": ""
-                    })
-                    failed += 1
-                    continue
+        model_env = env.get("WORDREPORTCHECK_MODEL")
+        if model_env:
+            model = model_env
+        else:
+            model = "deepseek-chat" if provider == "deepseek" else "moonshot-v1-128k"
+        if provider == "kimi" and model == "deepseek-chat":
+            model = "moonshot-v1-128k"
 
-                if provider == "deepseek":
-                    from .scoring.deepseek_client import score_items as _score_items
-                else:
-                    from .scoring.kimi_client import score_items as _score_items
-                results = _score_items(items, api_key=api_key, model=model)
+        # 只导入所选 Provider 的评分客户端
+        if provider == "deepseek":
+            from .scoring.deepseek_client import score_items
+        else:
+            from .scoring.kimi_client import score_items
 
-                # 3) 写出评分明细
-                scores_path = out_dir / (doc_path.stem + ".scores.json")
-                try:
-                    scores_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
-                    print(f"✅ [{doc_path.name}] 已写出评分明细 JSON 至: {scores_path}")
-                except Exception as e:
-                    print(f"⚠️ [{doc_path.name}] 写出评分明细失败: {e}")
-
-                # 4) 计算平均分并写回 JSON
-                avg = None
-                if isinstance(results, list):
-                    valid_scores = [x.get("score") for x in results if isinstance(x, dict) and isinstance(x.get("score"), (int, float))]
-                    avg = (sum(valid_scores) / len(valid_scores)) if valid_scores else None
-                if avg is not None:
-                    try:
-                        rd = report_from_json(json_path.read_text(encoding="utf-8"))
-                        rd.成绩 = f"{avg:.1f}"
-                        json_path.write_text(report_to_json(rd), encoding="utf-8")
-                        print(f"✅ [{doc_path.name}] 已在解析 JSON 写入成绩: {rd.成绩} -> {json_path}")
-                    except Exception as e:
-                        print(f"⚠️ [{doc_path.name}] 写入成绩到解析 JSON 失败: {e}")
-                else:
-                    print(f"⚠️ [{doc_path.name}] 未得到有效分数，未在解析 JSON 写入‘成绩’。")
+        opts = {
+            "segment_count": seg_count_arg,
+            "provider": provider,
+            "model": model,
+            "api_key": api_key,
+            "score_items": score_items,
+            "use_cache": not args.no_cache,
+        }
+        # 各文件相互独立且耗时主要在评分接口的网络往返，使用线程池并发处理（接口请求总数另有全局上限）。
+        # 递归遍历时不同子目录中的同名文件会写入同一组输出路径：按文件名（不含扩展名）分组，
+        # 组内按输入顺序串行处理（后处理的覆盖先处理的，与串行执行一致），不同组之间并发
+        from .scoring.common import worker_count
 
-                # 5) 将平均分写回到复制后的 DOCX（不修改源文件）
-                if avg is not None:
-                    try:
-                        from .parsers.docx_writer import write_grade_and_date
-                        out_docx = out_dir / doc_path.name
-                        try:
-                            shutil.copy2(doc_path, out_docx)
-                        except Exception as e:
-                            print(f"⚠️ [{doc_path.name}] 复制 DOCX 到输出目录失败: {e}")
-                            failed += 1
-                            continue
-                        ok = write_grade_and_date(out_docx, f"{avg:.1f}")
-                        if ok:
-                            print(f"✅ [{doc_path.name}] 已写回成绩到输出 DOCX: {out_docx}")
-                        else:
-                            print(f"⚠️ [{doc_path.name}] 未找到可写入的‘成绩/日期’单元格，未写入 DOCX。")
-                    except Exception as e:
-                        print(f"⚠️ [{doc_path.name}] 写回 DOCX 失败: {e}")
-
-                # 6) 打印简要总结（逐份）
-                summary = {
-                    "doc": str(doc_path),
-                    "doc_out": str(out_dir / doc_path.name),
-                    "json": str(json_path),
-                    "scores_json": str(scores_path),
-                    "provider": provider,
-                    "model": model,
-                    "average_score": None if avg is None else float(f"{avg:.1f}")
-                }
-                print(json.dumps(summary, ensure_ascii=False, indent=2))
-                # 加入 CSV 汇总行
-                csv_rows.append({
-                    "姓名": (report.姓名 or ""),
-                    "学号": (report.学号 or ""),
-                    "班级": (report.班级 or ""),
-                    "课程名称": (report.课程名称 or ""),
-                    "实验名称": (report.实验名称 or ""),
-                    "成绩": ("" if avg is None else f"{avg:.1f}")
-                })
-                total += 1
-            except Exception as e:
-                failed += 1
-                print(f"❌ [{doc_path.name}] 处理失败: {e}")
+        groups: Dict[str, List[Path]] = {}
+        for doc_path in docs:
+            groups.setdefault(os.path.normcase(doc_path.stem), []).append(doc_path)
+        workers = worker_count(len(groups))
 
-        # 写出成绩汇总 CSV
+        # 成绩汇总 CSV 在处理前打开，每份文档完成即写出一行并刷新，不在内存中累积整批结果；
+        # 中途中断时已完成文档的行也已落盘
         csv_path = out_dir / "grades.csv"
+        headers = ["姓名", "学号", "班级", "课程名称", "实验名称", "成绩"]
+        csv_fp = None
+        writer = None
         try:
-            headers = ["姓名", "学号", "班级", "课程名称", "实验名称", "成绩"]
-            with csv_path.open("w", newline="", encoding="utf-8-sig") as f:
-                writer = csv.DictWriter(f, fieldnames=headers)
-                writer.writeheader()
-                for row in csv_rows:
-                    writer.writerow({k: row.get(k, "") for k in headers})
-            print(f"✅ 已写出成绩汇总 CSV 至: {csv_path}")
+            csv_fp = csv_path.open("w", newline="", encoding="utf-8-sig")
+            # 失败行额外带有“文件名”键，不属于表头，写出时忽略
+            writer = csv.DictWriter(csv_fp, fieldnames=headers, extrasaction="ignore")
+            writer.writeheader()
         except Exception as e:
             print(f"⚠️ 写出成绩汇总 CSV 失败: {e}")
+            writer = None
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                pending = {key: ex.submit(_auto_dir_process_group, group, out_dir, opts) for key, group in groups.items()}
+                taken: Dict[str, int] = {}
+                for doc_path in docs:
+                    # 按输入顺序取回各文件的结果，日志与 CSV 行的顺序与串行执行一致
+                    key = os.path.normcase(doc_path.stem)
+                    k = taken.get(key, 0)
+                    taken[key] = k + 1
+                    outcome = pending[key].result()[k]
+                    # 每份文档的日志合并为一次写出，而不是逐行 print
+                    if outcome["log"]:
+                        sys.stdout.write("\n".join(outcome["log"]) + "\n")
+                    if outcome["row"] is not None and writer is not None:
+                        try:
+                            writer.writerow(outcome["row"])
+                            csv_fp.flush()
+                        except Exception as e:
+                            print(f"⚠️ 写出成绩汇总 CSV 失败: {e}")
+                            writer = None
+                    if outcome["status"] == "processed":
+                        total += 1
+                    else:
+                        failed += 1
+        finally:
+            if csv_fp is not None:
+                csv_fp.close()
+        if writer is not None:
+            print(f"✅ 已写出成绩汇总 CSV 至: {csv_path}")
 
         final_summary = {
             "in_dir": str(in_dir),
@@ -675,19 +918,23 @@ def main() -> int:
             "failed": failed,
             "csv": str(csv_path)
         }
-        print(json.dumps(final_summary, ensure_ascii=False, indent=2))
+        _print_json(final_summary)
         return 0
 
     if args.command == "write-docx":
         if not args.doc or not args.json:
             print("❌ 请同时提供 --doc 与 --json。")
             return 2
+        from .parsers.docx_writer import write_grade_and_date
+        from .schemas import report_from_json
+
         p = Path(args.json)
-        if not p.exists():
+        try:
+            json_text = p.read_text(encoding="utf-8")
+        except FileNotFoundError:
             print(f"❌ 未找到 JSON 文件: {p}")
             return 2
-        from .parsers.docx_writer import write_grade_and_date
-        rd = report_from_json(p.read_text(encoding="utf-8"))
+        rd = report_from_json(json_text)
         grade = (rd.成绩 or "").strip()
         if not grade:
             print("⚠️ JSON 顶层‘成绩’为空，无法写回 DOCX。请先评分并写入成绩。")
@@ -1,9 +1,40 @@
 from pathlib import Path
 from typing import List, Optional, Dict, Tuple
+from dataclasses import fields
+from functools import lru_cache
+import hashlib
+import json
+import mmap
+import os
+import posixpath
 import re
+import zipfile
 from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from docx.oxml.parser import element_class_lookup
+from lxml import etree
 
-from ..schemas import ReportItem, ReportDocument
+from ..schemas import ReportItem, ReportDocument, item_to_dict
+from ..user_cache import private_cache_dir
+
+
+# 解析结果缓存目录名：位于当前用户的 ~/.wordreportcheck 下，按 DOCX 内容哈希存放 ReportDocument 的 JSON
+_CACHE_NAME = "parse_cache"
+# 参与缓存键的源文件：解析逻辑（本模块）与 ReportDocument 定义（schemas）
+_PARSER_SOURCES = (Path(__file__), Path(__file__).parent.parent / "schemas.py")
+
+
+# 正则在模块加载时编译一次，逐行/逐题调用时直接复用
+# 题目编号：允许中文数字与阿拉伯数字
+_NUMERAL = r"[一二三四五六七八九十百千零〇\d]+"
+# 题目段标题“题目N：”（位于文首或行首）；题目内容为该标题到下一个标题或文末之间的文本
+_RE_SEGMENT_HEAD = re.compile(rf"(?:^|\n)(?:（[^）]*）)?\s*题目\s*{_NUMERAL}\s*[：:]\s*")
+# 题目段内的字段标签，允许“题目N”前缀
+_RE_FIELD_LABEL = re.compile(
+    rf"(?:^|\n)\s*(?:题目\s*{_NUMERAL}\s*)?(题目要求|题目|实验方法和步骤|方法和步骤|代码|运行结果)\s*[：:]\s*",
+    re.I,
+)
 
 
 def _strip(text: Optional[str]) -> str:
@@ -32,31 +63,37 @@ LABEL_MAP: Dict[str, str] = {
     "签名": "签名",
     "日期": "日期",
 }
+# 识别的字段名集合，供逐行判断标签时做 O(1) 成员测试
+_KNOWN_FIELDS = frozenset(LABEL_MAP.values())
 
 
 def _normalize_label(text: str) -> str:
-    t = _strip(text)
-    # 去掉末尾的冒号/全角冒号及空白
-    t = re.sub(r"[：:]\s*$", "", t)
-    # 替换常见空格/制表符
-    t = re.sub(r"\s+", "", t)
+    t = text.strip() if text else ""
+    # 去掉末尾的冒号/全角冒号（strip 后末尾已无空白，其后的空白由下一步统一去除）
+    if t and t[-1] in "：:":
+        t = t[:-1]
+    # 去除所有空白字符：split/join 在 C 层完成，与正则 \s 匹配的字符集一致
+    t = "".join(t.split())
     return LABEL_MAP.get(t, t)
 
 
-def _extract_row_label_value(row) -> Optional[Dict[str, str]]:
-    cells = row.cells
+def _extract_row_label_value(cells: list) -> Optional[Dict[str, str]]:
+    # cells 为 _row_grid_tcs 返回的 <w:tc> 序列（与 row.cells 一一对应）
     if not cells:
         return None
     if len(cells) >= 2:
-        label = _normalize_label(cells[0].text)
-        value = _strip(cells[1].text)
+        label = _normalize_label(_tc_text(cells[0]))
+        value = _tc_text(cells[1]).strip()
         return {"label": label, "value": value}
     # 单列情况：尝试按冒号分割
-    raw = _strip(cells[0].text)
-    parts = re.split(r"[：:]", raw, maxsplit=1)
-    if len(parts) == 2:
-        label = _normalize_label(parts[0])
-        value = _strip(parts[1])
+    raw = _tc_text(cells[0]).strip()
+    # 在第一个冒号（全角或半角，取先出现者）处切分；partition 在 C 层完成，无需正则
+    head, sep, tail = raw.partition("：")
+    if ":" in head:
+        head, sep, tail = raw.partition(":")
+    if sep:
+        label = _normalize_label(head)
+        value = tail.strip()
         return {"label": label, "value": value}
     return None
 
@@ -75,16 +112,12 @@ def _parse_content_items(content_text: str, expected_count: int) -> List[ReportI
     """
     text = content_text.replace("\r\n", "\n").replace("\r", "\n")
 
-    # 题目段边界识别：允许中文数字与阿拉伯数字
-    numeral = r"[一二三四五六七八九十百千零〇\d]+"
-    seg_pat = re.compile(
-        rf"(^|\n)(?:（[^）]*）)?\s*题目\s*{numeral}\s*[：:]\s*(.*?)(?=\n(?:（[^）]*）)?\s*题目\s*{numeral}\s*[：:]|\Z)",
-        re.S,
-    )
-
+    # 单次扫描定位所有题目标题，按相邻标题的位置切片取题目内容，不再用前瞻逐段匹配
+    heads = list(_RE_SEGMENT_HEAD.finditer(text))
     segments: List[str] = []
-    for m in seg_pat.finditer(text):
-        segments.append(_strip(m.group(2)))
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(text)
+        segments.append(_strip(text[m.end():end]))
 
     # 若未识别到题目结构，退化为整段作为一个“未知题目”项（避免空输出）
     if not segments and content_text.strip():
@@ -96,11 +129,7 @@ def _parse_content_items(content_text: str, expected_count: int) -> List[ReportI
         - 若缺少明确标签：首行作为题目名称或题目要求；其余作为方法；代码为空。
         """
         # 查找标签位置
-        label_pat = re.compile(
-            rf"(?:^|\n)\s*(?:题目\s*{numeral}\s*)?(题目要求|题目|实验方法和步骤|方法和步骤|代码|运行结果)\s*[：:]\s*",
-            re.I,
-        )
-        matches = list(label_pat.finditer(seg))
+        matches = list(_RE_FIELD_LABEL.finditer(seg))
         title: Optional[str] = None
         question = ""
         methods: Optional[str] = None
@@ -173,32 +202,65 @@ def _parse_content_items(content_text: str, expected_count: int) -> List[ReportI
     return items
 
 
-def _get_grid_span(cell) -> int:
-    # 兼容 python-docx 的 grid_span 属性，不存在时按 1 处理
-    return getattr(cell, "grid_span", 1)
+def _row_grid_tcs(tr) -> list:
+    """与 python-docx 的 row.cells 等价，但直接返回底层 <w:tc> 元素而不构造 _Cell 包装对象：
+    每个网格列对应一个元素（横向合并的单元格按跨列数重复），
+    纵向合并的续行单元格（vMerge=continue）取其上方的起始单元格。
+    """
+    tcs = []
+    for tc in tr.tc_lst:
+        while tc.vMerge == "continue":
+            tc = tc._tc_above
+        tcs.extend([tc] * tc.grid_span)
+    return tcs
+
+
+def _tc_text(tc) -> str:
+    # 与 python-docx 的 cell.text 一致：直接子段落的文本以换行连接
+    return "\n".join(p.text for p in tc.p_lst)
+
+
+# 模板顶部信息行：行号 -> {grid_span 累积列序号: 字段名}
+_TOP_ROW_FIELDS: Dict[int, Dict[int, str]] = {
+    0: {0: "学院信息", 1: "专业信息", 2: "时间"},
+    1: {1: "姓名", 3: "学号"},
+    2: {1: "班级", 3: "指导老师"},
+    3: {1: "课程名称", 3: "周次"},
+    4: {1: "实验名称"},
+}
+# “实验分析与体会”之后的行：相对该行的偏移 -> (列序号, 字段名)；列序号为 None 表示该行每一列都写入（以最后一列为准）
+_ANALYS_ROW_FIELDS: Dict[int, Tuple[Optional[int], str]] = {
+    1: (None, "实验分析与体会"),
+    2: (None, "实验日期"),
+    3: (1, "备注"),
+    4: (1, "成绩"),
+    6: (1, "日期"),
+}
 
 
-def _parse_by_template(doc: Document) -> Optional[ReportDocument]:
-    """按照用户提供的统一模板（行号 + grid_span 顺序）解析 18 项字段。
+def _parse_by_template(tbl) -> Optional[ReportDocument]:
+    """按照用户提供的统一模板（行号 + grid_span 顺序）解析 18 项字段，tbl 为正文第一个表格（<w:tbl>）。
 
     该模板特点：
     - 顶部若干行是信息汇总行，单元格可能合并，需用 grid_span 累积列索引
     - “实验内容”从包含该关键词的行开始，直到出现“实验分析与体会”为止
     - “实验分析与体会”之后的若干行依次为：实验日期、备注、成绩、（可能有签名行）、日期
     """
-    if not doc.tables:
+    # 直接在 python-docx 已解析的 lxml 元素上遍历（<w:tbl>/<w:tr>/<w:tc>），
+    # 不为表格、行、单元格、段落逐个构造包装对象
+    if tbl is None:
         return None
 
-    table = doc.tables[0]
-    rows = table.rows
+    rows = tbl.tr_lst
     if not rows:
         return None
 
     report = ReportDocument(content_items=[])
 
     def set_field(name: str, value: str):
+        # value 取自已去除首尾空白的单元格文本，无需再次 strip
         try:
-            setattr(report, name, _strip(value))
+            setattr(report, name, value)
         except Exception:
             pass
 
@@ -207,71 +269,55 @@ def _parse_by_template(doc: Document) -> Optional[ReportDocument]:
     content_buffer: List[str] = []
 
     for row_idx in range(len(rows)):
-        row = rows[row_idx]
-        # 行文本聚合（用于关键词检测）
-        row_text = " ".join([_strip(c.text) for c in row.cells])
-
-        # 先处理顶部信息汇总区（参考提供脚本的行号与索引）
-        grid_span_index = 0
-        col_idx = 0
-        while col_idx < len(row.cells):
-            cell = row.cells[col_idx]
-            text = _strip(cell.text)
-            span = _get_grid_span(cell)
-
-            if row_idx == 0:
-                if grid_span_index == 0:
-                    set_field("学院信息", text)
-                elif grid_span_index == 1:
-                    set_field("专业信息", text)
-                elif grid_span_index == 2:
-                    set_field("时间", text)
-            elif row_idx == 1:
-                if grid_span_index == 1:
-                    set_field("姓名", text)
-                elif grid_span_index == 3:
-                    set_field("学号", text)
-            elif row_idx == 2:
-                if grid_span_index == 1:
-                    set_field("班级", text)
-                elif grid_span_index == 3:
-                    set_field("指导老师", text)
-            elif row_idx == 3:
-                if grid_span_index == 1:
-                    set_field("课程名称", text)
-                elif grid_span_index == 3:
-                    set_field("周次", text)
-            elif row_idx == 4:
-                if grid_span_index == 1:
-                    set_field("实验名称", text)
-
-            # “实验分析与体会”之后的区块（以 analys_row_idx 为基准）
-            if analys_row_idx is not None:
-                if row_idx == analys_row_idx + 1:
-                    set_field("实验分析与体会", text)
-                elif row_idx == analys_row_idx + 2:
-                    set_field("实验日期", text)
-                elif row_idx == analys_row_idx + 3 and grid_span_index == 1:
-                    set_field("备注", text)
-                elif row_idx == analys_row_idx + 4 and grid_span_index == 1:
-                    set_field("成绩", text)
-                elif row_idx == analys_row_idx + 6 and grid_span_index == 1:
-                    set_field("日期", text)
-
-            col_idx += span
-            grid_span_index += 1
-
-        # 识别“实验内容”起止范围
-        if not content_started and ("实验内容" in row_text):
-            content_started = True
-            continue
-
-        if content_started and analys_row_idx is None:
+        # “实验分析与体会”之后第 6 行以后不再有任何字段或内容需要提取
+        if analys_row_idx is not None and row_idx > analys_row_idx + 6:
+            break
+        cells = _row_grid_tcs(rows[row_idx])
+        # 每个单元格的文本只提取一次：横向合并的单元格在 cells 中重复出现，按元素复用已提取的文本
+        tc_texts: Dict[int, str] = {}
+        texts: List[str] = []
+        for tc in cells:
+            key = id(tc)
+            t = tc_texts.get(key)
+            if t is None:
+                t = tc_texts[key] = _tc_text(tc).strip()
+            texts.append(t)
+
+        # 先处理顶部信息汇总区（参考提供脚本的行号与索引），再处理“实验分析与体会”之后的区块（以 analys_row_idx 为基准）。
+        # 按行号查表得到该行要写入的字段，不写入任何字段的行（如实验内容区）无需逐列遍历
+        top_fields = _TOP_ROW_FIELDS.get(row_idx)
+        analys_field = _ANALYS_ROW_FIELDS.get(row_idx - analys_row_idx) if analys_row_idx is not None else None
+        if top_fields or analys_field:
+            grid_span_index = 0
+            col_idx = 0
+            n_cells = len(cells)
+            while col_idx < n_cells:
+                text = texts[col_idx]
+                span = cells[col_idx].grid_span
+
+                if top_fields:
+                    name = top_fields.get(grid_span_index)
+                    if name:
+                        set_field(name, text)
+                if analys_field and (analys_field[0] is None or analys_field[0] == grid_span_index):
+                    set_field(analys_field[1], text)
+
+                col_idx += span
+                grid_span_index += 1
+
+        # 识别“实验内容”起止范围。关键词逐单元格短路判断：整行以空格连接时关键词本就不会跨单元格匹配，
+        # 结果与在整行文本上查找一致；只有内容区的行才需要拼接整行文本
+        if not content_started:
+            if any("实验内容" in t for t in texts):
+                content_started = True
+                continue
+        elif analys_row_idx is None:
             # 如果本行包含“实验分析与体会”，标记结束，并记录分析起始行索引
-            if "实验分析与体会" in row_text:
+            if any("实验分析与体会" in t for t in texts):
                 analys_row_idx = row_idx
             else:
                 # 在内容区，累积文本（整行作为一个段）
+                row_text = " ".join(texts)
                 if row_text:
                     content_buffer.append(row_text)
 
@@ -290,19 +336,174 @@ def _parse_by_template(doc: Document) -> Optional[ReportDocument]:
 
 
 def parse_docx_to_report(docx_path: Path) -> ReportDocument:
+    report = _parse_docx_streaming(docx_path)
+    if report is None:
+        # 非常规的包结构交给 python-docx 打开（并按其方式报错）
+        report = _parse_document(Document(str(docx_path)))
+    return report
+
+
+# 流式读取主文档部件时每次送入解析器的字节数
+_STREAM_CHUNK = 64 * 1024
+_W_BODY = qn("w:body")
+_W_TBL = qn("w:tbl")
+
+
+def _main_document_part_name(zf: zipfile.ZipFile) -> Optional[str]:
+    """按包关系（_rels/.rels）定位主文档部件并校验其内容类型，返回 zip 内的条目名；
+    不是常规 Word 文档（缺少关系或部件、内容类型不符等）时返回 None。
+    """
+    try:
+        rels = etree.fromstring(zf.read("_rels/.rels"))
+        target = next(rel.get("Target") for rel in rels if rel.get("Type") == RT.OFFICE_DOCUMENT)
+        part_name = posixpath.normpath(target.lstrip("/"))
+        zf.getinfo(part_name)
+        types = etree.fromstring(zf.read("[Content_Types].xml"))
+    except (KeyError, StopIteration, AttributeError, etree.XMLSyntaxError):
+        return None
+    # 与 python-docx 一致：先按部件名查 Override，再按扩展名查 Default（均不区分大小写）
+    content_type = None
+    part_uri = "/" + part_name.lower()
+    for el in types:
+        if etree.QName(el).localname == "Override" and (el.get("PartName") or "").lower() == part_uri:
+            content_type = el.get("ContentType")
+            break
+    else:
+        ext = part_name.rpartition(".")[2].lower()
+        for el in types:
+            if etree.QName(el).localname == "Default" and (el.get("Extension") or "").lower() == ext:
+                content_type = el.get("ContentType")
+                break
+    return part_name if content_type == CT.WML_DOCUMENT_MAIN else None
+
+
+def _parse_docx_streaming(docx_path: Path) -> Optional[ReportDocument]:
+    """不经 python-docx 打开整个包，直接从 zip 中流式解析主文档部件：
+    - 不读取、不解析样式与图片等其他部件；
+    - 模板解析只依赖正文第一个表格，该表格读完且按模板解析成功时即停止读取其余 XML；
+    - 模板不匹配时读完正文，按通用标签映射解析。
+    解析器设置与元素类均沿用 python-docx，结果与经 Document 打开时一致。
+    不是常规 Word 文档（非 zip、缺少主文档部件、内容类型不符等）时返回 None。
+    """
+    if not zipfile.is_zipfile(docx_path):
+        return None
+    with zipfile.ZipFile(docx_path) as zf:
+        part_name = _main_document_part_name(zf)
+        if part_name is None:
+            return None
+        parser = etree.XMLPullParser(events=("end",), tag=_W_TBL, remove_blank_text=True, resolve_entities=False)
+        parser.set_element_class_lookup(element_class_lookup)
+        first_tbl_seen = False
+        with zf.open(part_name) as f:
+            for chunk in iter(lambda: f.read(_STREAM_CHUNK), b""):
+                parser.feed(chunk)
+                for _, tbl in parser.read_events():
+                    # 只关心正文顶层的第一个表格（嵌套表格的父元素是 <w:tc>）
+                    if first_tbl_seen or tbl.getparent().tag != _W_BODY:
+                        continue
+                    first_tbl_seen = True
+                    report = _parse_by_template(tbl)
+                    if report:
+                        return report
+        root = parser.close()
+    return _parse_by_labels(root.body)
+
+
+def _file_digest(path: Path) -> str:
+    """文件内容的 blake2b 摘要。通过只读内存映射直接哈希，不把整个文件读成 bytes 副本
+    （含大量图片的报告可达数十 MB）；空文件无法映射，按空内容计算。
+    """
+    with open(path, "rb") as fh:
+        try:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return hashlib.blake2b(b"", digest_size=16).hexdigest()
+        with mm:
+            return hashlib.blake2b(mm, digest_size=16).hexdigest()
+
+
+# ReportDocument 的标量字段（按声明顺序），content_items 单独序列化
+_REPORT_SCALAR_FIELDS = tuple(f.name for f in fields(ReportDocument) if f.name != "content_items")
+
+
+def _report_to_cache_obj(report: ReportDocument) -> Dict:
+    """与 asdict(report) 结果相同的缓存对象，但直接按字段构造，不做递归深拷贝。"""
+    obj = {name: getattr(report, name) for name in _REPORT_SCALAR_FIELDS}
+    obj["content_items"] = None if report.content_items is None else [item_to_dict(i) for i in report.content_items]
+    return obj
+
+
+@lru_cache(maxsize=1)
+def _parser_fingerprint() -> str:
+    """解析器源码的摘要（首次调用时计算）：解析逻辑或结果结构一有改动，旧缓存即自然失效，
+    不依赖发版时手动修改版本号。源码无法读取时返回空串，由调用方跳过缓存。
+    """
+    h = hashlib.blake2b(digest_size=8)
+    try:
+        for src in _PARSER_SOURCES:
+            h.update(src.read_bytes())
+    except OSError:
+        return ""
+    return h.hexdigest()
+
+
+def parse_docx_to_report_cached(docx_path: Path) -> ReportDocument:
+    """带缓存的 parse_docx_to_report：以文件内容的 blake2b 哈希（及解析器源码摘要）为键，
+    命中时直接加载缓存的解析结果，无需再解压与解析 DOCX；未命中时解析并写入缓存。
+    缓存放在当前用户私有的目录中；缓存读写失败不影响解析本身。
+    """
+    fingerprint = _parser_fingerprint()
+    cache_dir = private_cache_dir(_CACHE_NAME) if fingerprint else None
+    if cache_dir is None:
+        return parse_docx_to_report(docx_path)
+    key = _file_digest(docx_path)
+    cache_path = cache_dir / f"{fingerprint}-{key}.json"
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        items = cached.pop("content_items", None)
+        if items is not None:
+            items = [ReportItem(**i) for i in items]
+        return ReportDocument(**cached, content_items=items)
+    except (OSError, ValueError, TypeError, AttributeError):
+        pass
+
+    report = parse_docx_to_report(docx_path)
+    try:
+        # 先写临时文件再替换，避免并发进程读到写了一半的缓存
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(_report_to_cache_obj(report), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return report
+
+
+def parse_docx_to_report_with_doc(docx_path: Path) -> Tuple[ReportDocument, Document]:
+    """解析 DOCX，同时返回已打开的 Document，供随后写回成绩时复用，避免再次打开与解压同一文件。"""
     doc = Document(str(docx_path))
+    return _parse_document(doc), doc
+
+
+def _parse_document(doc: Document) -> ReportDocument:
+    body = doc.element.body
+    tbls = body.tbl_lst
     # 优先按统一模板严格解析
-    tmpl_report = _parse_by_template(doc)
+    tmpl_report = _parse_by_template(tbls[0] if tbls else None)
     if tmpl_report:
         return tmpl_report
 
     # 模板不匹配时使用通用标签映射解析
+    return _parse_by_labels(body)
+
+
+def _parse_by_labels(body) -> ReportDocument:
+    """通用标签映射解析：遍历正文所有顶层表格（<w:body> 下的 <w:tbl>）的每一行，按“标签 | 值”提取字段。"""
     report = ReportDocument(content_items=[])
     content_accumulator: List[str] = []
 
-    for table in doc.tables:
-        for row in table.rows:
-            pair = _extract_row_label_value(row)
+    for tbl in body.tbl_lst:
+        for tr in tbl.tr_lst:
+            pair = _extract_row_label_value(_row_grid_tcs(tr))
             if not pair:
                 continue
             label = pair["label"]
@@ -312,7 +513,7 @@ def parse_docx_to_report(docx_path: Path) -> ReportDocument:
                     content_accumulator.append(value)
                 continue
             # 仅当是我们识别的18个单元之一时赋值
-            if label in LABEL_MAP.values():
+            if label in _KNOWN_FIELDS:
                 try:
                     setattr(report, label, value)
                 except Exception:
@@ -1,59 +1,91 @@
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime
+import shutil
+import zipfile
 from docx import Document
+from docx.table import _Cell
+from lxml import etree
 
+from .docx_parser import _row_grid_tcs, _tc_text
 
-def _find_label_row_and_value_cell(table, label: str, prefer_prev_if_last: bool = False) -> Optional[tuple]:
-    """在给定表格中查找包含指定标签的行，并返回(行对象, 值单元格index)。
+
+def _index_table(tbl) -> Tuple[List[list], Dict[Any, str]]:
+    """单次遍历表格（<w:tbl> 元素），收集“可见上”为两列的行（考虑水平合并后的两列）。
+    返回 (行索引 [(可见单元格的 <w:tc> 列表)], {<w:tc>: 文本})。
+    直接在底层元素上遍历并读取文本，不构造 python-docx 的行/单元格包装对象；
+    每个单元格的文本只读取一次，“成绩”与“日期”的查找共用该索引；
+    文本按 <w:tc> 存放，纵向合并而跨行共享的单元格写入后各行看到的文本保持一致。
+    """
+    rows = []
+    texts: Dict[Any, str] = {}
+    for tr in tbl.tr_lst:
+        # 构建可见单元格序列（按首次出现顺序去重 <w:tc>，合并后多个网格列可能共享同一 <w:tc>）
+        try:
+            grid_tcs = _row_grid_tcs(tr)
+        except Exception:
+            # 合并结构异常的行（如纵向合并的上一行缺少对应网格列）无法读取；
+            # 与逐行查找遇到异常即停止的行为一致，只索引此前的行
+            break
+        visible = []
+        for tc in grid_tcs:
+            if tc not in visible:
+                visible.append(tc)
+
+        # 仅处理可见为两列的行
+        if len(visible) != 2:
+            continue
+        for tc in visible:
+            if tc not in texts:
+                texts[tc] = _tc_text(tc).strip()
+        rows.append(visible)
+    return rows, texts
+
+
+def _find_label_value_cell(index: Tuple[List[list], Dict[Any, str]], label: str, prefer_prev_if_last: bool = False) -> Optional[tuple]:
+    """在 _index_table 的结果中查找包含指定标签的行，返回 (该行可见单元格列表, 值单元格的可见索引)。
     规则：
-    - 仅处理“可见上”为两列的行（考虑水平合并后的两列）；
     - 优先选择同一行中非标签的右侧相邻可见单元格作为值单元格；
     - 如标签位于该行最后一列，且启用 prefer_prev_if_last，则写到前一列。
     """
-    try:
-        for row in table.rows:
-            # 构建可见单元格序列（按首次出现顺序去重 _tc）
-            raw_cells = list(row.cells)
-            unique_order_indices = []  # 可见单元格对应的 row.cells 索引
-            seen_tcs = set()
-            for i, c in enumerate(raw_cells):
-                tc = getattr(c, "_tc", None)
-                # _tc 作为底层单元格标识，合并后多个 Cell 可能共享同一 _tc
-                key = tc if tc is not None else id(c)
-                if key not in seen_tcs:
-                    seen_tcs.add(key)
-                    unique_order_indices.append(i)
-
-            # 仅处理可见为两列的行
-            if len(unique_order_indices) != 2:
-                continue
+    rows, texts = index
+    # 兼容中英文冒号、去除所有空白字符
+    lbl_norm = "".join(label.replace("：", ":").split())
+    for visible in rows:
+        # 遍历可见单元格以匹配标签
+        for vis_idx, tc in enumerate(visible):
+            text = texts[tc]
+            # 先做原文包含判断，未命中时才构造归一化文本
+            if (label in text) or (lbl_norm in "".join(text.replace("：", ":").split())):
+                # 选择值单元格（优先右侧相邻的可见单元格）
+                if vis_idx + 1 < len(visible):
+                    target_vis_idx = vis_idx + 1
+                elif prefer_prev_if_last and vis_idx - 1 >= 0:
+                    target_vis_idx = vis_idx - 1
+                else:
+                    target_vis_idx = 0
+                return visible, target_vis_idx
+    return None
 
-            # 遍历可见单元格以匹配标签
-            for vis_idx, raw_idx in enumerate(unique_order_indices):
-                cell = raw_cells[raw_idx]
-                text = (cell.text or "").strip()
-                # 兼容中英文冒号、去除所有空白字符
-                normalized = text.replace("：", ":")
-                normalized = "".join(normalized.split())
-                lbl_norm = label.replace("：", ":")
-                lbl_norm = "".join(lbl_norm.split())
-
-                if (label in text) or (lbl_norm in normalized):
-                    # 选择值单元格（优先右侧相邻的可见单元格）
-                    target_vis_idx = None
-                    if vis_idx + 1 < len(unique_order_indices):
-                        target_vis_idx = vis_idx + 1
-                    elif prefer_prev_if_last and vis_idx - 1 >= 0:
-                        target_vis_idx = vis_idx - 1
-                    else:
-                        target_vis_idx = 0
-
-                    target_raw_idx = unique_order_indices[target_vis_idx]
-                    return (row, target_raw_idx)
-        return None
-    except Exception:
-        return None
+
+def find_value_cell(texts: List[str], label: str) -> Optional[int]:
+    """在一行各单元格的文本中查找第一个包含 label 的单元格，返回其值单元格的下标：
+    右侧相邻的单元格；标签位于行末时为 0。未找到返回 None。
+    供 scripts/ 下的调试与强制写入工具使用，规则比 _find_label_value_cell 简单（不区分可见列）。
+    """
+    for idx, text in enumerate(texts):
+        if label in text:
+            return idx + 1 if idx + 1 < len(texts) else 0
+    return None
+
+
+def _set_indexed_cell_text(index: Tuple[List[list], Dict[Any, str]], loc: tuple, value: str) -> None:
+    """写入 _find_label_value_cell 定位到的单元格，并同步索引中的文本，供后续标签查找使用。"""
+    visible, vis_idx = loc
+    tc = visible[vis_idx]
+    # 与 cell.text 赋值一致：清空原有内容后写入单个段落
+    _Cell(tc, None).text = value
+    index[1][tc] = value.strip()
 
 
 def write_grade_and_date(doc_path: Path, grade: str, date_str: Optional[str] = None) -> bool:
@@ -67,32 +99,82 @@ def write_grade_and_date(doc_path: Path, grade: str, date_str: Optional[str] = N
     except Exception:
         return False
 
+    if not write_grade_and_date_doc(doc, grade, date_str):
+        return False
+    try:
+        doc.save(str(doc_path))
+    except Exception:
+        return False
+    return True
+
+
+def write_grade_and_date_doc(doc, grade: str, date_str: Optional[str] = None) -> bool:
+    """与 write_grade_and_date 相同的写入规则，但作用于已打开的 Document 且不保存，
+    由调用方决定保存位置（例如复用解析阶段已打开的文档，直接保存到输出路径）。
+    返回 True 表示至少写入了一个字段。
+    """
     wrote_any = False
     date_val = date_str or datetime.now().strftime("%Y.%m.%d")
 
     try:
-        for table in doc.tables:
+        for tbl in doc.element.body.tbl_lst:
+            # 每个表格只遍历一次行与单元格，“成绩”与“日期”在同一索引上查找
+            try:
+                index = _index_table(tbl)
+            except Exception:
+                continue
             # 写入成绩（当标签在最后一列时，优先写到前一列）
-            loc = _find_label_row_and_value_cell(table, "成绩", prefer_prev_if_last=True)
+            loc = _find_label_value_cell(index, "成绩", prefer_prev_if_last=True)
             if loc is not None:
-                row, val_idx = loc
                 try:
-                    row.cells[val_idx].text = str(grade)
+                    _set_indexed_cell_text(index, loc, str(grade))
                     wrote_any = True
                 except Exception:
                     pass
-            # 写入日期
-            loc2 = _find_label_row_and_value_cell(table, "日期")
+            # 写入日期（索引中的文本已反映上面写入的成绩）
+            loc2 = _find_label_value_cell(index, "日期")
             if loc2 is not None:
-                row2, val_idx2 = loc2
                 try:
-                    row2.cells[val_idx2].text = str(date_val)
+                    _set_indexed_cell_text(index, loc2, str(date_val))
                     wrote_any = True
                 except Exception:
                     pass
-        if wrote_any:
-            doc.save(str(doc_path))
     except Exception:
         return False
 
-    return wrote_any
\ No newline at end of file
+    return wrote_any
+
+
+def write_grade_and_date_streaming(src: Path, dst: Path, grade: str, date_str: Optional[str] = None, doc=None) -> bool:
+    """将写入成绩/日期后的文档输出到 dst，源文件 src 保持不变：
+    - 仅重新序列化主文档部件（word/document.xml），其余部件（图片等）从 src 按原样流式拷贝，
+      不经 python-docx 重新打包整个文件；
+    - 传入解析阶段已打开的 doc 时直接复用，否则打开 src；
+    - 未找到可写入的单元格时按原样复制 src。
+    返回 True 表示至少写入了一个字段。
+    """
+    if Path(dst).resolve() == Path(src).resolve():
+        raise shutil.SameFileError(f"{src} 与 {dst} 是同一文件")
+    if doc is None:
+        doc = Document(str(src))
+    if not write_grade_and_date_doc(doc, grade, date_str):
+        shutil.copy2(src, dst)
+        return False
+    save_document_part(doc, src, dst)
+    return True
+
+
+def save_document_part(doc, src: Path, dst: Path) -> None:
+    """将已修改的 doc 输出到 dst：仅重新序列化主文档部件（word/document.xml），
+    其余部件从打开 doc 时的源文件 src 按原样流式拷贝。dst 不能与 src 相同。
+    """
+    part_name = doc.part.partname.lstrip("/")
+    # 与 python-docx 保存时的序列化方式一致
+    xml = etree.tostring(doc.element, encoding="UTF-8", standalone=True)
+    with zipfile.ZipFile(str(src)) as zin, zipfile.ZipFile(str(dst), "w") as zout:
+        for info in zin.infolist():
+            if info.filename == part_name:
+                zout.writestr(info, xml, compress_type=zipfile.ZIP_DEFLATED)
+            else:
+                with zin.open(info) as fsrc, zout.open(info, "w") as fdst:
+                    shutil.copyfileobj(fsrc, fdst)
@@ -1,9 +1,19 @@
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 import json
+import sys
 
+try:
+    import orjson
+except ImportError:  # 可选加速依赖，未安装时回退到标准库 json
+    orjson = None
 
-@dataclass
+
+# Python 3.10+ 为数据类生成 __slots__：实例不再携带 __dict__，内存更省、属性访问更快
+_DATACLASS_OPTS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_OPTS)
 class ReportItem:
     id: str
     question: str
@@ -15,7 +25,7 @@ class ReportItem:
     title: Optional[str] = None
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTS)
 class ReportDocument:
     学院信息: Optional[str] = None
     专业信息: Optional[str] = None
@@ -37,7 +47,7 @@ class ReportDocument:
     # 原始“实验内容”全文（不经分割，用于发送到 AI）
     实验内容原文: Optional[str] = None
     # 实验内容（题干与答案）
-    content_items: List[ReportItem] = None  # type: ignore
+    content_items: List[ReportItem] = field(default_factory=list)
 
     def to_json_obj(self) -> Dict[str, Any]:
         # 自定义 items 的序列化：同时输出英文与中文字段，满足评分与展示需求
@@ -84,8 +94,19 @@ class ReportDocument:
         return obj
 
 
+def _dumps_indented(obj: Any) -> str:
+    # 安装了 orjson 时用其序列化（2 空格缩进，输出与标准库一致）；
+    # 遇到 orjson 不支持的值（如孤立代理字符）时回退到标准库
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode("utf-8")
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+
 def report_to_json(report: ReportDocument) -> str:
-    return json.dumps(report.to_json_obj(), ensure_ascii=False, indent=2)
+    return _dumps_indented(report.to_json_obj())
 
 
 def report_from_json(json_str: str) -> ReportDocument:
@@ -141,8 +162,20 @@ def report_from_json(json_str: str) -> ReportDocument:
     )
 
 
+def item_to_dict(item: ReportItem) -> Dict[str, Any]:
+    # 字段均为标量，直接构造 dict，避免 asdict 逐字段递归深拷贝
+    return {
+        "id": item.id,
+        "question": item.question,
+        "answer": item.answer,
+        "methods": item.methods,
+        "code": item.code,
+        "title": item.title,
+    }
+
+
 def items_to_json(items: List[ReportItem]) -> str:
-    return json.dumps([asdict(i) for i in items], ensure_ascii=False, indent=2)
+    return _dumps_indented([item_to_dict(i) for i in items])
 
 
 def items_from_json(json_str: str) -> List[ReportItem]:
@@ -0,0 +1,125 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Tuple
+
+from openai import BadRequestError, OpenAI, UnprocessableEntityError
+
+from ..schemas import ReportItem
+
+
+@lru_cache(maxsize=4)
+def get_client(api_key: str, base_url: str) -> OpenAI:
+    """按 (api_key, base_url) 复用 OpenAI 客户端：连接池与 TLS 会话在多次调用（含并发线程）间共享。
+    两个评分客户端共用同一缓存，同一进程内切换提供方不会重复建立连接池。
+    """
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+
+def _configured_workers() -> int:
+    """WORDREPORTCHECK_WORKERS 的取值（默认 8），至少为 1。"""
+    try:
+        workers = int(os.getenv("WORDREPORTCHECK_WORKERS", "8"))
+    except Exception:
+        workers = 8
+    return max(1, workers)
+
+
+def worker_count(n: int) -> int:
+    """并发线程数：WORDREPORTCHECK_WORKERS（默认 8），不超过任务数 n，至少为 1。"""
+    return max(1, min(_configured_workers(), n))
+
+
+# 进程内同时在途的接口请求上限，与 WORDREPORTCHECK_WORKERS 相同：auto-dir 的文档线程与逐题回退的线程池
+# 嵌套时，请求总数仍不超过该值，避免触发服务端限流。首次导入评分客户端时确定（此时 .env 已加载）
+_API_SLOTS = threading.BoundedSemaphore(_configured_workers())
+
+
+def safe_chat_create(client: OpenAI, **kwargs) -> Any:
+    """安全调用 chat.completions.create，异常时返回 None；请求期间占用一个全局请求名额。"""
+    with _API_SLOTS:
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception:
+            return None
+
+
+# 已拒绝 response_format 参数的 (接口地址, 模型)：之后直接使用普通文本模式，不再先发一次必然失败的请求
+_TEXT_ONLY: set = set()
+
+
+def _rejects_response_format(exc: Exception) -> bool:
+    """请求参数错误（400/422）且错误信息指向 response_format/JSON 模式时，视为服务端不支持 JSON 响应模式。"""
+    if not isinstance(exc, (BadRequestError, UnprocessableEntityError)):
+        return False
+    msg = str(exc).lower()
+    return "response_format" in msg or "json_object" in msg
+
+
+def chat_create_json(client: OpenAI, **kwargs) -> Any:
+    """以 JSON 响应模式（服务端保证输出可解析的 JSON 对象）调用 chat.completions.create。
+    仅当服务端拒绝 response_format 参数时以普通文本模式重试一次；限流、超时等其他异常不重试，返回 None。
+    """
+    endpoint = (str(client.base_url), kwargs.get("model"))
+    with _API_SLOTS:
+        if endpoint not in _TEXT_ONLY:
+            try:
+                return client.chat.completions.create(response_format={"type": "json_object"}, **kwargs)
+            except Exception as e:
+                if not _rejects_response_format(e):
+                    return None
+                _TEXT_ONLY.add(endpoint)
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception:
+            return None
+
+
+def unwrap_item_list(parsed: Any) -> Any:
+    """批量评分回复中的评分数组：JSON 模式下包在对象中（约定为 items 字段，其他字段名但只有一个数组值时同样接受）；
+    普通文本模式可能直接返回数组。无法识别时原样返回。
+    """
+    if isinstance(parsed, dict):
+        if isinstance(parsed.get("items"), list):
+            return parsed["items"]
+        lists = [v for v in parsed.values() if isinstance(v, list)]
+        if len(lists) == 1:
+            return lists[0]
+    return parsed
+
+
+def parallel_score(score_item: Callable[..., Any], items: List[Any], **kwargs: Any) -> List[Any]:
+    """逐题评分：各题请求相互独立，使用线程池并发以重叠网络等待；map 保持题目顺序。
+    kwargs 原样传给 score_item；并发数见 worker_count。
+    """
+    fn = partial(score_item, **kwargs)
+    workers = worker_count(len(items))
+    if workers == 1:
+        return [fn(it) for it in items]
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(fn, items))
+
+
+def dedupe_items(items: List[ReportItem]) -> Tuple[List[ReportItem], List[int]]:
+    """按 (题干, 答案) 去重：返回 (去重后的题目列表, 每个原题目对应的去重下标)。"""
+    first: Dict[Tuple[str, str], int] = {}
+    uniq: List[ReportItem] = []
+    owner: List[int] = []
+    for it in items:
+        key = (it.question, it.answer)
+        k = first.get(key)
+        if k is None:
+            k = first[key] = len(uniq)
+            uniq.append(it)
+        owner.append(k)
+    return uniq, owner
+
+
+def expand_results(items: List[ReportItem], uniq: List[ReportItem], owner: List[int], scored: List[Any]) -> List[Any]:
+    """把去重后题目的评分结果按原顺序分发到每个题目；重复题目的结果复制一份并改为各自的 id。"""
+    results = []
+    for it, k in zip(items, owner):
+        r = scored[k]
+        results.append(r if uniq[k] is it else dict(r, id=it.id))
+    return results
@@ -1,16 +1,38 @@
+import heapq
 import json
 import os
+import re
 from typing import List, Any, Dict, Optional
-from openai import OpenAI
+
+try:
+    import orjson
+except ImportError:  # 可选加速依赖，未安装时回退到标准库 json
+    orjson = None
 
 from ..schemas import ReportItem
+from .common import chat_create_json, dedupe_items, expand_results, get_client, parallel_score, safe_chat_create, unwrap_item_list
+from .response_cache import load_cached_content, response_cache_key, store_cached_content
 
 
 SYSTEM_PROMPT = (
     "你是一位严格的教学助教，负责批改学生实验报告。"
     "请对每个题目进行评分，满分100分，并给出简要反馈。"
-    "只输出 JSON 数组，数组元素为对象：{id, score, feedback}。"
 )
+# 评分请求使用 JSON 响应模式，输出必须是 JSON 对象：批量评分把数组包在 items 字段中，单题评分直接返回评分对象
+_SYSTEM_PROMPT_BATCH = SYSTEM_PROMPT + "只输出 JSON 对象 {\"items\": [...]}，items 数组元素为对象：{id, score, feedback}。"
+_SYSTEM_PROMPT_ITEM = SYSTEM_PROMPT + "只输出 JSON 对象：{id, score, feedback}。"
+
+
+def _loads_json(text: Any) -> Any:
+    """解析模型回复中的 JSON：安装了 orjson 时优先使用；其拒绝而标准库接受的输入
+    （如 NaN）再交给标准库，失败时抛出的异常与 json.loads 一致。
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except (orjson.JSONDecodeError, TypeError):
+            pass
+    return json.loads(text)
 
 
 def _ensure_scored(obj: Any, item: ReportItem, raw: str = None) -> Dict[str, Any]:
@@ -39,17 +61,14 @@ def _ensure_scored(obj: Any, item: ReportItem, raw: str = None) -> Dict[str, Any
     return result
 
 
-def _safe_chat_create(client: OpenAI, **kwargs) -> Any:
-    """安全调用 chat.completions.create，异常时返回 None。"""
-    try:
-        return client.chat.completions.create(**kwargs)
-    except Exception:
-        return None
+def score_items(items: List[ReportItem], api_key: str, model: str = "deepseek-chat", use_cache: bool = True) -> Any:
+    # 题干与答案完全相同的题目只评一次，结果按原顺序分发到每个题目（id 改为各自的 id）
+    uniq, owner = dedupe_items(items)
+    if len(uniq) < len(items):
+        return expand_results(items, uniq, owner, score_items(uniq, api_key=api_key, model=model, use_cache=use_cache))
 
-
-def score_items(items: List[ReportItem], api_key: str, model: str = "deepseek-chat") -> Any:
     base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
 
     payload = [
         {
@@ -61,30 +80,32 @@ def score_items(items: List[ReportItem], api_key: str, model: str = "deepseek-ch
     ]
 
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": _SYSTEM_PROMPT_BATCH},
         {
             "role": "user",
             "content": (
                 "以下是学生的题干与答案，请逐题评分并给出反馈。"
-                "严格以 JSON 数组返回，每个元素形如 {id, score, feedback}。\n\n"
+                "严格以 JSON 对象返回，形如 {\"items\": [{id, score, feedback}, ...]}，items 按题目顺序排列。\n\n"
                 + json.dumps(payload, ensure_ascii=False)
             ),
         },
     ]
 
-    resp = _safe_chat_create(client, model=model, messages=messages, temperature=0)
+    # 以 JSON 响应模式请求（不被支持时改用普通文本模式）；调用失败则逐题回退
+    resp = chat_create_json(client, model=model, messages=messages, temperature=0)
     if resp is None:
-        return [score_item(it, api_key=api_key, model=model) for it in items]
+        return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
     content = resp.choices[0].message.content
 
     try:
         parsed = None
         try:
-            parsed = json.loads(content)
+            parsed = _loads_json(content)
         except Exception:
             block = _extract_json_block(content)
             if block:
-                parsed = json.loads(block)
+                parsed = _loads_json(block)
+        parsed = unwrap_item_list(parsed)
         if isinstance(parsed, list):
             ensured: List[Dict[str, Any]] = []
             by_id: Dict[str, Any] = {}
@@ -98,14 +119,15 @@ def score_items(items: List[ReportItem], api_key: str, model: str = "deepseek-ch
                 ensured.append(_ensure_scored(obj or {}, it))
             return ensured
         else:
-            return [score_item(it, api_key=api_key, model=model) for it in items]
+            return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
     except Exception:
-        return [score_item(it, api_key=api_key, model=model) for it in items]
+        return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
 
 
-def score_item(item: ReportItem, api_key: str, model: str = "deepseek-chat") -> Any:
+def score_item(item: ReportItem, api_key: str, model: str = "deepseek-chat", use_cache: bool = True) -> Any:
+    """为单个题目评分。use_cache 为 True 时，相同请求（接口地址、模型、消息）的模型回复从磁盘缓存复用。"""
     base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
 
     payload = {
         "id": item.id,
@@ -114,7 +136,7 @@ def score_item(item: ReportItem, api_key: str, model: str = "deepseek-chat") ->
     }
 
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": _SYSTEM_PROMPT_ITEM},
         {
             "role": "user",
             "content": (
@@ -125,28 +147,46 @@ def score_item(item: ReportItem, api_key: str, model: str = "deepseek-chat") ->
         },
     ]
 
-    resp = _safe_chat_create(client, model=model, messages=messages, temperature=0)
-    if resp is None:
-        return _ensure_scored({}, item, raw="模型调用失败：可能超出上下文限制或服务端错误")
-    content = resp.choices[0].message.content
+    cache_key = response_cache_key(base_url, model, messages) if use_cache else None
+    content = load_cached_content(cache_key) if cache_key else None
+    if content is None:
+        # 单题输出本就是 JSON 对象：使用 JSON 响应模式，不被支持时改用普通文本模式
+        resp = chat_create_json(client, model=model, messages=messages, temperature=0)
+        if resp is None:
+            # 接口调用失败（限流、超时等）：保底结果带 error 标记，调用方据此不写入成绩
+            return dict(_ensure_scored({}, item, raw="模型调用失败：可能超出上下文限制或服务端错误"), error=True)
+        content = resp.choices[0].message.content
 
     try:
         obj = None
         try:
-            obj = json.loads(content)
+            obj = _loads_json(content)
         except Exception:
             block = _extract_json_block(content)
             if block:
-                obj = json.loads(block)
+                obj = _loads_json(block)
+        if isinstance(obj, dict) and cache_key:
+            # 只缓存能解析出评分对象的回复，解析失败的回复下次重新请求
+            store_cached_content(cache_key, content)
         return _ensure_scored(obj if isinstance(obj, dict) else {}, item)
     except Exception:
         return _ensure_scored({}, item, raw=content)
 
 
+def _extract_field(block: str, marker: str, end_marker: str) -> str:
+    """截取分隔符协议中首个字段标记之后、到字段结束标记（缺失则到块末尾）的内容；按下标切片，不复制标记后的整段尾部。"""
+    pos = block.find(marker)
+    if pos == -1:
+        return ""
+    vstart = pos + len(marker)
+    vend = block.find(end_marker, vstart)
+    return (block[vstart:] if vend == -1 else block[vstart:vend]).strip()
+
+
 def segment_items_from_content(content: str, expected_count: int, api_key: str, model: str = "deepseek-chat") -> List[ReportItem]:
     """使用 DeepSeek 将实验内容原文分割为指定数量的题目（带重试与分隔符协议）。"""
     base_url = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
     # 使用完整原文进行分割，无截断
     content_trunc = content
 
@@ -154,6 +194,8 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
     SENT_ITEM_END = "§§§WRC_ITEM_END§§§"
     SENT_FIELD_BEGIN = "§§§WRC_FIELD:"
     SENT_FIELD_END = "§§§WRC_FIELD_END§§§"
+    # 各字段起始标记只构造一次，供每次重试与每个题目复用
+    field_markers = {name: f"{SENT_FIELD_BEGIN}{name}§§§" for name in ("题目名称", "题目要求", "实验方法和步骤", "代码")}
 
     base_sys_prompt = (
         "你是一位教学助教，负责解析实验报告的‘实验内容’。"
@@ -183,6 +225,9 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
         attempts = 3
     attempts = max(1, min(attempts, 5))
 
+    # 输出上限随期望题目数增长（每题约 200 token），至少 1600，最多 8192
+    seg_max_tokens = min(8192, max(1600, 200 * expected_count))
+
     last_raw: Optional[str] = None
     last_parsed: Any = None
     last_len: Optional[int] = None
@@ -197,13 +242,10 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 "必须严格以原文中‘题目n’标题为边界进行切分，id 写成对应标题（题目1…题目N），"
                 "不要输出任何 JSON/引号/多余文本。若不足，请在保持标题边界的前提下合理拆分为多个子题以满足数量。"
             )
-            messages = [
-                {"role": "system", "content": base_sys_prompt},
-                {"role": "user", "content": reinforce_msg},
-                base_messages[1],
-            ]
+            # 系统提示与原文消息直接复用首轮构造的对象，仅新增强化提示
+            messages = [base_messages[0], {"role": "user", "content": reinforce_msg}, base_messages[1]]
 
-        resp = _safe_chat_create(client, model=model, messages=messages, temperature=0, max_tokens=1600)
+        resp = safe_chat_create(client, model=model, messages=messages, temperature=0, max_tokens=seg_max_tokens)
         if resp is None:
             last_raw = None
             last_parsed = None
@@ -240,20 +282,12 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                     if t.lower().startswith("id:"):
                         rid = t.split(":", 1)[1].strip()
                         break
-                def _extract_field(name: str) -> str:
-                    marker = f"{SENT_FIELD_BEGIN}{name}§§§"
-                    if marker not in block:
-                        return ""
-                    after = block.split(marker, 1)[1]
-                    if SENT_FIELD_END in after:
-                        return after.split(SENT_FIELD_END, 1)[0].strip()
-                    return after.strip()
                 obj = {
                     "id": rid,
-                    "题目名称": _extract_field("题目名称"),
-                    "题目要求": _extract_field("题目要求"),
-                    "实验方法和步骤": _extract_field("实验方法和步骤"),
-                    "代码": _extract_field("代码"),
+                    "题目名称": _extract_field(block, field_markers["题目名称"], SENT_FIELD_END),
+                    "题目要求": _extract_field(block, field_markers["题目要求"], SENT_FIELD_END),
+                    "实验方法和步骤": _extract_field(block, field_markers["实验方法和步骤"], SENT_FIELD_END),
+                    "代码": _extract_field(block, field_markers["代码"], SENT_FIELD_END),
                 }
                 items.append(obj)
             return items
@@ -266,14 +300,14 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 parsed = delimited
             if parsed is None:
                 try:
-                    parsed = json.loads(raw)
+                    parsed = _loads_json(raw)
                 except Exception:
                     parsed = None
             if parsed is None:
                 block = _extract_json_block(raw)
                 if block:
                     try:
-                        parsed = json.loads(block)
+                        parsed = _loads_json(block)
                     except Exception:
                         parsed = None
             if isinstance(parsed, dict):
@@ -288,7 +322,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                         break
                     if isinstance(c, str):
                         try:
-                            loaded = json.loads(c)
+                            loaded = _loads_json(c)
                             if isinstance(loaded, list):
                                 arr = loaded
                                 break
@@ -324,7 +358,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 block = _extract_json_block(raw)
                 if block:
                     try:
-                        tmp = json.loads(block)
+                        tmp = _loads_json(block)
                         if isinstance(tmp, list):
                             parsed = tmp
                     except Exception:
@@ -357,16 +391,15 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                     deficit = expected_count - len(parsed)
                     # 仅当 parsed 为 list 且 deficit > 0 时进行启发式拆分
                     if isinstance(parsed, list) and deficit > 0:
-                        work = list(parsed)
-                        while deficit > 0 and work:
+                        # 各段按加入序号存放（拆分出的两段追加在末尾）；最长段用以 (-长度, 加入序号) 为键的堆选取，
+                        # 长度相同时取靠前的一段，与逐次线性扫描选出的段一致
+                        work = dict(enumerate(parsed))
+                        heap = [(-_length_of(seg), i) for i, seg in work.items()]
+                        heapq.heapify(heap)
+                        next_seq = len(work)
+                        while deficit > 0 and heap:
                             # 选择当前内容最长的一段进行拆分
-                            idx_long = 0
-                            max_len = -1
-                            for i, seg in enumerate(work):
-                                l = _length_of(seg if isinstance(seg, dict) else {})
-                                if l > max_len:
-                                    max_len = l
-                                    idx_long = i
+                            _, idx_long = heapq.heappop(heap)
                             seg = work.pop(idx_long)
                             if not isinstance(seg, dict):
                                 seg = {}
@@ -399,13 +432,12 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                                 parts = [seg, {"题目要求": q0, "实验方法和步骤": m0, "代码": c0, "answer": ""}]
 
                             # 将拆分出的两段加入工作集末尾，直到凑够数量
-                            work.extend(parts)
-                            if len(work) >= expected_count:
-                                parsed = work[:expected_count]
-                                break
-                            else:
-                                deficit = expected_count - len(work)
-                                parsed = work
+                            for part in parts:
+                                work[next_seq] = part
+                                heapq.heappush(heap, (-_length_of(part), next_seq))
+                                next_seq += 1
+                            deficit = expected_count - len(work)
+                        parsed = list(work.values())
 
                     # 若仍不足，进入下一次重试；若已满足，继续构建结果
                     if not isinstance(parsed, list) or len(parsed) != expected_count:
@@ -461,7 +493,14 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
         raise ValueError(f"题目数量不匹配：期望 {expected_count}，实际 {last_len}")
 
 
+# JSON 结构字符：括号、引号与反斜杠
+_RE_JSON_STRUCT = re.compile(r'[\[\]{}"\\]')
+
+
 def _extract_json_block(text: str):
+    """按括号配对从回复文本中截取 JSON 数组/对象（优先数组）。
+    仅用正则跳转到结构字符，字符串字面量中的括号不计入配对。
+    """
     if not text:
         return None
     for open_ch, close_ch in (('[', ']'), ('{', '}')):
@@ -469,14 +508,26 @@ def _extract_json_block(text: str):
         if start == -1:
             continue
         depth = 0
-        for i in range(start, len(text)):
-            ch = text[i]
-            if ch == open_ch:
+        in_string = False
+        escaped_pos = -1
+        for m in _RE_JSON_STRUCT.finditer(text, start):
+            pos = m.start()
+            ch = m.group()
+            if in_string:
+                if pos == escaped_pos:
+                    continue
+                if ch == "\\":
+                    escaped_pos = pos + 1
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == open_ch:
                 depth += 1
             elif ch == close_ch:
                 depth -= 1
                 if depth == 0:
-                    return text[start : i + 1]
+                    return text[start : pos + 1]
     return None
 
 # 已移除截断功能：始终使用完整文本，避免任何长度裁剪
\ No newline at end of file
@@ -1,11 +1,18 @@
 import json
 import os
+import re
 from typing import List, Any, Dict
-from openai import OpenAI
 from typing import Optional, Tuple
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # 可选加速依赖，未安装时回退到标准库 json
+    orjson = None
+
 from ..schemas import ReportItem
+from .common import chat_create_json, dedupe_items, expand_results, get_client, parallel_score, safe_chat_create, unwrap_item_list
+from .response_cache import load_cached_content, response_cache_key, store_cached_content
 
 
 SYSTEM_PROMPT = (
@@ -13,6 +20,23 @@ SYSTEM_PROMPT = (
     "请对每个题目进行评分，满分100分，并给出简要反馈。"
     "只输出 JSON，严格遵守：不允许任何解释、前后缀、Markdown 或代码块。"
 )
+# 批量/单题评分的完整系统提示在导入时拼接一次，各次调用直接复用同一字符串。
+# 评分请求使用 JSON 响应模式，输出必须是 JSON 对象，批量评分的数组包在 items 字段中
+_SYSTEM_PROMPT_BATCH = SYSTEM_PROMPT + "仅返回 JSON 对象 {\"items\": [...]}，items 数组的每个元素为 {id, score, feedback}。"
+_SYSTEM_PROMPT_ITEM = SYSTEM_PROMPT + "仅返回 JSON 对象 {id, score, feedback}。"
+
+
+def _loads_json(text: Any) -> Any:
+    """Parse JSON from a model reply, preferring orjson when installed.
+    Inputs orjson rejects but the stdlib accepts (e.g. NaN) are retried with
+    json.loads, so errors surface exactly as before.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except (orjson.JSONDecodeError, TypeError):
+            pass
+    return json.loads(text)
 
 
 def _ensure_scored(obj: Any, item: ReportItem, raw: str = None) -> Dict[str, Any]:
@@ -46,9 +70,15 @@ def _ensure_scored(obj: Any, item: ReportItem, raw: str = None) -> Dict[str, Any
     return result
 
 
+# Structural characters of JSON: brackets, quotes and backslashes
+_RE_JSON_STRUCT = re.compile(r'[\[\]{}"\\]')
+
+
 def _extract_json_block(text: str) -> Optional[str]:
     """Extract a JSON array/object substring from free-form text by bracket matching.
     Returns the best-effort block or None if not found.
+    Only structural characters are visited (via regex), and brackets inside
+    JSON string literals are ignored.
     """
     if not text:
         return None
@@ -58,56 +88,59 @@ def _extract_json_block(text: str) -> Optional[str]:
         if start == -1:
             continue
         depth = 0
-        for i in range(start, len(text)):
-            ch = text[i]
-            if ch == open_ch:
+        in_string = False
+        escaped_pos = -1
+        for m in _RE_JSON_STRUCT.finditer(text, start):
+            pos = m.start()
+            ch = m.group()
+            if in_string:
+                if pos == escaped_pos:
+                    continue
+                if ch == "\\":
+                    escaped_pos = pos + 1
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == open_ch:
                 depth += 1
             elif ch == close_ch:
                 depth -= 1
                 if depth == 0:
-                    return text[start : i + 1]
+                    return text[start : pos + 1]
     return None
 
+
+# A JSON string literal (an unterminated one runs to the end of the text)
+_RE_JSON_STRING = re.compile(r'"(?:[^"\\]|\\.)*"?', re.S)
+# Inside a literal: an escape pair (kept as is) or a raw line break
+_RE_ESCAPE_OR_NEWLINE = re.compile(r'\\.|[\r\n]', re.S)
+# A trailing comma before a closing bracket/brace, whitespace allowed in between
+_RE_TRAILING_COMMA = re.compile(r',(\s*[\]}])')
+
+
+def _escape_string_newlines(m: "re.Match") -> str:
+    """Replace raw CR/LF in a matched string literal with "\\n", leaving escape pairs untouched."""
+    s = m.group()
+    if "\n" not in s and "\r" not in s:
+        return s
+    return _RE_ESCAPE_OR_NEWLINE.sub(lambda e: "\\n" if len(e.group()) == 1 else e.group(), s)
+
+
 def _sanitize_json_like(text: str) -> str:
     """Best-effort sanitize of a JSON-like string:
     - Converts newlines within string literals to escaped "\\n" to avoid control-character errors
-    - Removes trailing commas before closing brackets/brace
+    - Removes trailing commas (optionally followed by whitespace) before closing brackets/brace
+    Both steps are regex substitutions, so only string literals and commas are visited.
     """
     if not text:
         return ""
-    out_chars = []
-    in_string = False
-    escaped = False
-    for ch in text:
-        if in_string:
-            if escaped:
-                # Previous char was a backslash; current char is escaped
-                out_chars.append(ch)
-                escaped = False
-                continue
-            if ch == "\\":
-                out_chars.append(ch)
-                escaped = True
-                continue
-            if ch == '"':
-                out_chars.append(ch)
-                in_string = False
-                continue
-            if ch == "\n" or ch == "\r":
-                out_chars.append("\\n")
-                continue
-            out_chars.append(ch)
-        else:
-            if ch == '"':
-                out_chars.append(ch)
-                in_string = True
-                escaped = False
-            else:
-                out_chars.append(ch)
-    sanitized = "".join(out_chars)
+    sanitized = _RE_JSON_STRING.sub(_escape_string_newlines, text)
     # Remove trailing commas before array/object close
-    sanitized = sanitized.replace(",]", "]").replace(",}", "}")
-    return sanitized
+    return _RE_TRAILING_COMMA.sub(r"\1", sanitized)
+
+
+_TRUNCATE_NOTE = "\n[内容过长，已截断，仅评估上述片段]"
 
 
 def _truncate(text: str, max_chars: int) -> str:
@@ -115,79 +148,71 @@ def _truncate(text: str, max_chars: int) -> str:
         t = (text or "")
         if len(t) <= max_chars:
             return t
-        return t[:max_chars] + "\n[内容过长，已截断，仅评估上述片段]"
+        return t[:max_chars] + _TRUNCATE_NOTE
     except Exception:
         return (text or "")
 
 
-def _safe_chat_create(client: OpenAI, **kwargs) -> Any:
-    """安全调用 chat.completions.create，异常时返回 None。"""
-    try:
-        return client.chat.completions.create(**kwargs)
-    except Exception:
-        return None
-
+def score_items(items: List[ReportItem], api_key: str, model: str = "moonshot-v1-128k", use_cache: bool = True) -> Any:
+    # 题干与答案完全相同的题目只评一次，结果按原顺序分发到每个题目（id 改为各自的 id）
+    uniq, owner = dedupe_items(items)
+    if len(uniq) < len(items):
+        return expand_results(items, uniq, owner, score_items(uniq, api_key=api_key, model=model, use_cache=use_cache))
 
-def score_items(items: List[ReportItem], api_key: str, model: str = "moonshot-v1-128k") -> Any:
     # Kimi (Moonshot) 使用 OpenAI 兼容接口，设置 base_url 即可
     base_url = os.getenv("MOONSHOT_BASE_URL", "https://api.moonshot.cn/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
 
     # 输入截断以避免超过模型的上下文限制
     max_input_chars = int(os.getenv("WORDREPORTCHECK_MAX_INPUT_CHARS", "128000"))
+    question_cap = max_input_chars // 4
     payload = [
         {
             "id": i.id,
-            "question": _truncate(i.question, max_input_chars // 4),
+            "question": _truncate(i.question, question_cap),
             "answer": _truncate(i.answer, max_input_chars),
         }
         for i in items
     ]
 
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT + "仅返回 JSON 数组，每个元素为 {id, score, feedback}。"},
+        {"role": "system", "content": _SYSTEM_PROMPT_BATCH},
         {
             "role": "user",
             "content": (
                 "以下是学生的题干与答案，请逐题评分并给出反馈。"
-                "只返回 JSON 数组，不要任何解释或标记。\n\n"
+                "只返回 JSON 对象，形如 {\"items\": [{id, score, feedback}, ...]}，items 按题目顺序排列，不要任何解释或标记。\n\n"
                 + json.dumps(payload, ensure_ascii=False)
             ),
         },
     ]
 
-    # 尝试启用 JSON 响应模式；若不被服务端支持，则回退
-    # 先尝试 JSON 响应模式，失败则回退普通文本模式；若两次都失败，则逐题回退
-    resp = _safe_chat_create(
+    # 输出上限随题目数增长（每题约 120 token），至少 1024，最多 4096，避免题目多时回复被截断
+    max_tokens = min(4096, max(1024, 64 + 120 * len(items)))
+
+    # 以 JSON 响应模式请求（不被服务端支持时改用普通文本模式）；调用失败则逐题回退
+    resp = chat_create_json(
         client,
         model=model,
         messages=messages,
         temperature=0,
-        response_format={"type": "json_object"},
-        max_tokens=1024,
+        max_tokens=max_tokens,
     )
-    if resp is None:
-        resp = _safe_chat_create(
-            client,
-            model=model,
-            messages=messages,
-            temperature=0,
-            max_tokens=1024,
-        )
     if resp is None:
         # Fallback: per-item calls
-        return [score_item(it, api_key=api_key, model=model) for it in items]
+        return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
     content = resp.choices[0].message.content
 
     try:
         parsed = None
         try:
-            parsed = json.loads(content)
+            parsed = _loads_json(content)
         except Exception:
             block = _extract_json_block(content)
             if block:
-                parsed = json.loads(block)
-        # Expect a list; ensure each mapped item has score/feedback
+                parsed = _loads_json(block)
+        # Expect a list (wrapped in an object in JSON mode); ensure each mapped item has score/feedback
+        parsed = unwrap_item_list(parsed)
         if isinstance(parsed, list):
             ensured: List[Dict[str, Any]] = []
             # try align by id; fallback by index
@@ -203,15 +228,16 @@ def score_items(items: List[ReportItem], api_key: str, model: str = "moonshot-v1
             return ensured
         else:
             # Fallback: per-item calls to guarantee outputs
-            return [score_item(it, api_key=api_key, model=model) for it in items]
+            return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
     except Exception:
         # Fallback: per-item calls
-        return [score_item(it, api_key=api_key, model=model) for it in items]
+        return parallel_score(score_item, items, api_key=api_key, model=model, use_cache=use_cache)
 
 
-def score_item(item: ReportItem, api_key: str, model: str = "moonshot-v1-128k") -> Any:
+def score_item(item: ReportItem, api_key: str, model: str = "moonshot-v1-128k", use_cache: bool = True) -> Any:
+    """为单个题目评分。use_cache 为 True 时，相同请求（接口地址、模型、消息）的模型回复从磁盘缓存复用。"""
     base_url = os.getenv("MOONSHOT_BASE_URL", "https://api.moonshot.cn/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
 
     # 输入截断以避免超过模型的上下文限制
     max_input_chars = int(os.getenv("WORDREPORTCHECK_MAX_INPUT_CHARS", "128000"))
@@ -222,7 +248,7 @@ def score_item(item: ReportItem, api_key: str, model: str = "moonshot-v1-128k")
     }
 
     messages = [
-        {"role": "system", "content": SYSTEM_PROMPT + "仅返回 JSON 对象 {id, score, feedback}。"},
+        {"role": "system", "content": _SYSTEM_PROMPT_ITEM},
         {
             "role": "user",
             "content": (
@@ -233,40 +259,49 @@ def score_item(item: ReportItem, api_key: str, model: str = "moonshot-v1-128k")
         },
     ]
 
-    resp = _safe_chat_create(
-        client,
-        model=model,
-        messages=messages,
-        temperature=0,
-        response_format={"type": "json_object"},
-        max_tokens=512,
-    )
-    if resp is None:
-        resp = _safe_chat_create(
+    cache_key = response_cache_key(base_url, model, messages) if use_cache else None
+    content = load_cached_content(cache_key) if cache_key else None
+    if content is None:
+        resp = chat_create_json(
             client,
             model=model,
             messages=messages,
             temperature=0,
             max_tokens=512,
         )
-    if resp is None:
-        # 构造保底返回（未调用到模型）
-        return _ensure_scored({}, item, raw="模型调用失败：可能超出上下文限制或服务端错误")
-    content = resp.choices[0].message.content
+        if resp is None:
+            # 构造保底返回（未调用到模型）；带 error 标记，调用方据此不写入成绩
+            return dict(_ensure_scored({}, item, raw="模型调用失败：可能超出上下文限制或服务端错误"), error=True)
+        content = resp.choices[0].message.content
 
     try:
         obj = None
         try:
-            obj = json.loads(content)
+            obj = _loads_json(content)
         except Exception:
             block = _extract_json_block(content)
             if block:
-                obj = json.loads(block)
+                obj = _loads_json(block)
+        if isinstance(obj, dict) and cache_key:
+            # 只缓存能解析出评分对象的回复，解析失败的回复下次重新请求
+            store_cached_content(cache_key, content)
         return _ensure_scored(obj if isinstance(obj, dict) else {}, item)
     except Exception:
         return _ensure_scored({}, item, raw=content)
 
 
+def _extract_field(block: str, marker: str, end_marker: str) -> str:
+    """Return the text after the first field marker up to the next field end marker
+    (or the end of the block), sliced by index instead of split().
+    """
+    pos = block.find(marker)
+    if pos == -1:
+        return ""
+    vstart = pos + len(marker)
+    vend = block.find(end_marker, vstart)
+    return (block[vstart:] if vend == -1 else block[vstart:vend]).strip()
+
+
 def segment_items_from_content(content: str, expected_count: int, api_key: str, model: str = "moonshot-v1-128k") -> List[ReportItem]:
     """使用 Kimi/Moonshot 将实验内容原文分割为指定数量的题目。
 
@@ -274,7 +309,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
     环境变量 WORDREPORTCHECK_SEGMENT_RETRY 控制（默认 3 次）。
     """
     base_url = os.getenv("MOONSHOT_BASE_URL", "https://api.moonshot.cn/v1")
-    client = OpenAI(api_key=api_key, base_url=base_url)
+    client = get_client(api_key, base_url)
 
     max_input_chars = int(os.getenv("WORDREPORTCHECK_MAX_INPUT_CHARS", "128000"))
     content_trunc = _truncate(content, max_input_chars)
@@ -284,6 +319,8 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
     SENT_ITEM_END = "§§§WRC_ITEM_END§§§"
     SENT_FIELD_BEGIN = "§§§WRC_FIELD:"
     SENT_FIELD_END = "§§§WRC_FIELD_END§§§"
+    # 各字段起始标记只构造一次，供每次重试与每个题目复用
+    field_markers = {name: f"{SENT_FIELD_BEGIN}{name}§§§" for name in ("题目要求", "实验方法和步骤", "代码")}
 
     base_sys_prompt = (
         "你是一位教学助教，负责解析实验报告的‘实验内容’。"
@@ -314,6 +351,9 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
         attempts = 3
     attempts = max(1, min(attempts, 5))
 
+    # 输出上限随期望题目数增长（每题约 200 token），至少 1600，最多 8192
+    seg_max_tokens = min(8192, max(1600, 200 * expected_count))
+
     last_raw = None
     last_parsed: Any = None
     last_len = None
@@ -327,18 +367,15 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 f"请严格输出正好 {expected_count} 段，按 Q1..Q{expected_count} 顺序，每段都包含三部分，"
                 "只使用分隔符协议，不要输出任何 JSON/引号/多余文本。若不足，请将问题拆分为多个子题以满足数量。"
             )
-            messages = [
-                {"role": "system", "content": base_sys_prompt},
-                {"role": "user", "content": reinforce_msg},
-                base_messages[1],
-            ]
+            # 系统提示与原文消息直接复用首轮构造的对象，仅新增强化提示
+            messages = [base_messages[0], {"role": "user", "content": reinforce_msg}, base_messages[1]]
 
-        resp = _safe_chat_create(
+        resp = safe_chat_create(
             client,
             model=model,
             messages=messages,
             temperature=0,
-            max_tokens=1600,
+            max_tokens=seg_max_tokens,
         )
         if resp is None:
             # 进入下一次重试
@@ -385,20 +422,11 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                         rid = t.split(":", 1)[1].strip()
                         break
                 # 读取三个字段
-                def _extract_field(name: str) -> str:
-                    marker = f"{SENT_FIELD_BEGIN}{name}§§§"
-                    if marker not in block:
-                        return ""
-                    after = block.split(marker, 1)[1]
-                    if SENT_FIELD_END in after:
-                        return after.split(SENT_FIELD_END, 1)[0].strip()
-                    return after.strip()
-
                 obj = {
                     "id": rid,
-                    "题目要求": _extract_field("题目要求"),
-                    "实验方法和步骤": _extract_field("实验方法和步骤"),
-                    "代码": _extract_field("代码"),
+                    "题目要求": _extract_field(block, field_markers["题目要求"], SENT_FIELD_END),
+                    "实验方法和步骤": _extract_field(block, field_markers["实验方法和步骤"], SENT_FIELD_END),
+                    "代码": _extract_field(block, field_markers["代码"], SENT_FIELD_END),
                 }
                 items.append(obj)
             return items
@@ -412,7 +440,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
             # 1) 直接尝试解析完整响应
             if parsed is None:
                 try:
-                    parsed = json.loads(raw)
+                    parsed = _loads_json(raw)
                 except Exception:
                     parsed = None
             # 2) 若失败，尝试提取文本中的 JSON 片段再解析
@@ -420,7 +448,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 block = _extract_json_block(raw)
                 if block:
                     try:
-                        parsed = json.loads(block)
+                        parsed = _loads_json(block)
                     except Exception:
                         parsed = None
             # 3) 接受对象形式并从 items/segments 中取数组（容忍字典或字符串形式）
@@ -436,7 +464,7 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                         break
                     if isinstance(c, str):
                         try:
-                            loaded = json.loads(c)
+                            loaded = _loads_json(c)
                             if isinstance(loaded, list):
                                 arr = loaded
                                 break
@@ -479,19 +507,19 @@ def segment_items_from_content(content: str, expected_count: int, api_key: str,
                 block = _extract_json_block(raw)
                 if block:
                     try:
-                        tmp = json.loads(block)
+                        tmp = _loads_json(block)
                         if isinstance(tmp, list):
                             parsed = tmp
                     except Exception:
                         try:
-                            tmp2 = json.loads(_sanitize_json_like(block))
+                            tmp2 = _loads_json(_sanitize_json_like(block))
                             if isinstance(tmp2, list):
                                 parsed = tmp2
                         except Exception:
                             pass
                 else:
                     try:
-                        tmp3 = json.loads(_sanitize_json_like(raw))
+                        tmp3 = _loads_json(_sanitize_json_like(raw))
                         if isinstance(tmp3, list):
                             parsed = tmp3
                     except Exception:
@@ -542,8 +570,13 @@ def _load_env_file() -> None:
             Path(__file__).resolve().parents[2] / ".env",
         ]
         for env_path in candidates:
-            if env_path.exists():
-                for raw in env_path.read_text(encoding="utf-8").splitlines():
+            # 直接尝试打开（EAFP），省去单独的 exists() 检查；逐行读取，不构造整份行列表
+            try:
+                f = env_path.open("r", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                for raw in f:
                     line = raw.strip()
                     if not line or line.startswith("#"):
                         continue
@@ -556,7 +589,7 @@ def _load_env_file() -> None:
                     value = value.strip().strip('"').strip("'")
                     if key and (key not in os.environ):
                         os.environ[key] = value
-                break
+            break
     except Exception:
         pass
 
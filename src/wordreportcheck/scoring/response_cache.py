@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Optional
+
+from ..user_cache import private_cache_dir
+
+
+# 评分响应缓存目录名：位于当前用户的 ~/.wordreportcheck 下，见 private_cache_dir
+_CACHE_NAME = "score_cache"
+
+
+def response_cache_key(base_url: str, model: str, messages: Any) -> str:
+    """以接口地址、模型与完整消息（含系统提示与题目载荷）的 blake2b 摘要为键。
+    评分请求均为 temperature=0，相同输入的模型输出可直接复用。
+    """
+    raw = json.dumps([base_url, model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def load_cached_content(key: str) -> Optional[str]:
+    """读取缓存的模型回复原文；不存在或读取失败时返回 None。"""
+    cache_dir = private_cache_dir(_CACHE_NAME)
+    if cache_dir is None:
+        return None
+    try:
+        return (cache_dir / f"score-{key}.txt").read_text(encoding="utf-8")
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached_content(key: str, content: str) -> None:
+    """写入模型回复原文。先写临时文件再替换，避免并发线程/进程读到写了一半的缓存；写入失败时忽略。"""
+    cache_dir = private_cache_dir(_CACHE_NAME)
+    if cache_dir is None:
+        return
+    try:
+        path = cache_dir / f"score-{key}.txt"
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(content, encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
@@ -0,0 +1,27 @@
+import os
+import stat
+from pathlib import Path
+from typing import Optional
+
+
+def private_cache_dir(name: str) -> Optional[Path]:
+    """返回（必要时创建）~/.wordreportcheck/<name> 缓存目录，并确保各级目录只有当前用户可访问（0700）。
+    缓存不放在所有用户共享的系统临时目录中，他人无法预先放置或篡改缓存文件。
+    无法确定主目录、目录无法创建或不属于当前用户时返回 None，调用方应视为不使用缓存。
+    """
+    try:
+        root = Path.home() / ".wordreportcheck"
+    except RuntimeError:
+        return None
+    path = root / name
+    try:
+        for d in (root, path):
+            d.mkdir(mode=0o700, exist_ok=True)
+            st = d.stat()
+            if hasattr(os, "getuid") and st.st_uid != os.getuid():
+                return None
+            if stat.S_IMODE(st.st_mode) & 0o077:
+                os.chmod(d, 0o700)
+    except OSError:
+        return None
+    return path